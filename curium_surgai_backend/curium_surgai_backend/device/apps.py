@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
+
+
+class DeviceConfig(AppConfig):
+    name = "device"
+
+    def ready(self):
+        from .models import Device
+        from .registry import device_changed
+
+        # Running extractors reload their device registry on any change
+        post_save.connect(device_changed, sender=Device)
+        post_delete.connect(device_changed, sender=Device)
@@ -0,0 +1,58 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from device.registry import DeviceRegistry
+from extractor import ENGINES, create_subscriber
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the MQTT frame extractor. SIGTERM or SIGINT stops receiving, "
+        "drains the frames already received and finalizes open videos; a "
+        "second signal exits right away."
+    )
+
+    def add_arguments(self, parser):
+        # Overrides of settings.EXTRACTOR, mostly for running several workers
+        parser.add_argument("--engine", choices=ENGINES)
+        parser.add_argument("--share-group")
+        parser.add_argument("--worker-index", type=int)
+        parser.add_argument("--worker-count", type=int)
+        parser.add_argument("--metrics-port", type=int)
+        parser.add_argument("--preview-port", type=int)
+
+    def handle(self, *args, **options):
+        config = dict(settings.EXTRACTOR)
+        for name in ("engine", "share_group", "worker_index", "worker_count"):
+            if options[name] is not None:
+                config[name] = options[name]
+        for name in ("metrics_port", "preview_port"):
+            if options[name] is not None:
+                config[name] = options[name] or None
+        if settings.EXTRACTOR_DEVICE_REFRESH:
+            registry = DeviceRegistry(
+                config["base_output_folder"], settings.EXTRACTOR_DEVICE_REFRESH
+            )
+            registry.refresh()
+            config["device_registry"] = registry
+        subscriber = create_subscriber(**config)
+
+        def request_stop(signum, frame):
+            self.stdout.write(f"{signal.Signals(signum).name} received, draining")
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            subscriber.disconnect()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        self.stdout.write(
+            f"Extractor ({config['engine']} engine) receiving "
+            f"{config['topic']} from {config['broker_address']}:{config['broker_port']}"
+        )
+        # Returns once disconnect() has stopped the MQTT loop
+        subscriber.start()
+        subscriber.stop()
+        self.stdout.write("Extractor stopped")
@@ -0,0 +1,112 @@
+"""In-memory registry of the devices allowed to stream.
+
+The extractor checks the device_id of every message against it before
+creating a tracker or decoding anything, so traffic from unregistered or
+inactive devices costs one set lookup. The registry holds the stream ids
+(device_stream_ids) of all active devices, loaded in one query, and
+reloads them every refresh_interval seconds or soon after a Device is
+saved or deleted.
+
+The extractor runs in a process of its own, so the post_save and
+post_delete handlers cannot reach its registry directly: they touch a
+marker file in the shared media folder, whose mtime refresh_if_stale()
+checks. Until the first load succeeds every device is let through, so a
+database outage at startup does not cost recordings.
+"""
+
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+from .models import Device
+
+logger = logging.getLogger(__name__)
+
+CHANGED_FILENAME = "devices.changed"
+
+# Seconds between reloads when no change has been signalled
+REFRESH_INTERVAL = 60.0
+
+
+def device_stream_ids(device):
+    """Identifiers a device may use as the device_id segment of its topics"""
+    return {
+        device.mac_address,
+        str(device.device_id),
+        device.mqtt_topic.rstrip("/").rsplit("/", 1)[-1],
+    }
+
+
+def changed_path(folder=None):
+    return os.path.join(folder or settings.STREAM_STATUS_FOLDER, CHANGED_FILENAME)
+
+
+def device_changed(sender, **kwargs):
+    """post_save/post_delete handler: have running registries reload"""
+    path = changed_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a"):
+            pass
+        os.utime(path)
+    except OSError as e:
+        logger.warning("Error marking the device registry changed: %s", e)
+
+
+class DeviceRegistry:
+    """Stream ids of the active devices, reloaded from the device table"""
+
+    def __init__(self, folder=None, refresh_interval=REFRESH_INTERVAL):
+        self.marker = changed_path(folder)
+        self.refresh_interval = refresh_interval
+        # None until the first load: every device is let through
+        self.stream_ids = None
+        self.loaded_at = 0
+        self.marker_mtime = None
+        # Messages dropped for an unregistered device_id
+        self.rejected = 0
+
+    def is_registered(self, device_id):
+        stream_ids = self.stream_ids
+        return stream_ids is None or device_id in stream_ids
+
+    def reject(self):
+        self.rejected += 1
+
+    def refresh_if_stale(self):
+        """Reload if a device changed or refresh_interval has passed"""
+        if (
+            self._marker_mtime() == self.marker_mtime
+            and time.monotonic() - self.loaded_at < self.refresh_interval
+        ):
+            return False
+        return self.refresh()
+
+    def refresh(self):
+        # Read before the query, so a change made during it reloads again
+        marker_mtime = self._marker_mtime()
+        # A failed load is retried after refresh_interval, not every call
+        self.loaded_at = time.monotonic()
+        self.marker_mtime = marker_mtime
+        try:
+            # The connection may have gone stale since the last reload
+            close_old_connections()
+            stream_ids = set()
+            for device in Device.objects.filter(is_active=True).only(
+                "device_id", "mac_address", "mqtt_topic"
+            ):
+                stream_ids |= device_stream_ids(device)
+        except DatabaseError as e:
+            logger.warning("Error loading the device registry: %s", e)
+            return False
+        self.stream_ids = frozenset(stream_ids)
+        return True
+
+    def _marker_mtime(self):
+        try:
+            return os.stat(self.marker).st_mtime_ns
+        except OSError:
+            return None
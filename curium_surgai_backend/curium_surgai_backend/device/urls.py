@@ -1,9 +1,17 @@
 from django.urls import path
-from .views import DeviceCreateView, start_stream, get_device_details
+from .views import (
+    DeviceCreateView,
+    start_stream,
+    get_device_details,
+    list_stream_sessions,
+    get_stream_status,
+)
 
 
 urlpatterns = [
     path("device/register", DeviceCreateView.as_view(), name="device-register"),
     path("stream/start", start_stream, name="start-stream"),
     path("device", get_device_details, name="fetch-device"),
+    path("stream/sessions", list_stream_sessions, name="stream-sessions"),
+    path("stream/status", get_stream_status, name="stream-status"),
 ]
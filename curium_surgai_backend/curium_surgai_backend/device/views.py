@@ -5,9 +5,15 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from .models import Device
 from drf_yasg.utils import swagger_auto_schema
+from .registry import device_stream_ids
 from .serializers import DeviceSerializer
 from drf_yasg import openapi
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.conf import settings
+from ingest.status import read_status
+import re
+
+MAC_ADDRESS_PATTERN = re.compile(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$")
 
 
 @swagger_auto_schema(
@@ -148,10 +154,7 @@ def get_device_details(request):
         )
 
     # Optional: Add MAC address format validation
-    import re
-
-    mac_pattern = re.compile(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$")
-    if not mac_pattern.match(mac_address):
+    if not MAC_ADDRESS_PATTERN.match(mac_address):
         return Response(
             {"error": "Invalid MAC address format. Use format XX:XX:XX:XX:XX:XX"},
             status=status.HTTP_400_BAD_REQUEST,
@@ -166,3 +169,88 @@ def get_device_details(request):
             {"error": "Device not found or you don't have permission to access it"},
             status=status.HTTP_404_NOT_FOUND,
         )
+
+
+ERROR_SCHEMA = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        "error": openapi.Schema(type=openapi.TYPE_STRING, description="Error message")
+    },
+)
+
+
+@swagger_auto_schema(
+    method="get",
+    operation_description=(
+        "List the sessions the extractor is currently receiving, with rolling "
+        "fps, inter-frame jitter, bytes/s and time since the last frame, and "
+        "its recent video builds"
+    ),
+    responses={
+        200: openapi.Response(
+            description="Active sessions, video builds and extractor workers"
+        ),
+        401: "Unauthorized",
+    },
+    tags=["Devices"],
+)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def list_stream_sessions(request):
+    # Served from the extractor's status snapshot, never from its live state
+    return Response(read_status(settings.STREAM_STATUS_FOLDER))
+
+
+@swagger_auto_schema(
+    method="get",
+    operation_description="Get the live stream status of a device",
+    manual_parameters=[
+        openapi.Parameter(
+            "mac_address",
+            openapi.IN_QUERY,
+            description="MAC address of the device",
+            type=openapi.TYPE_STRING,
+            required=True,
+        )
+    ],
+    responses={
+        200: openapi.Response(description="Stream status of the device"),
+        400: openapi.Response(description="Invalid MAC address", schema=ERROR_SCHEMA),
+        404: openapi.Response(description="Device not found", schema=ERROR_SCHEMA),
+        401: "Unauthorized",
+    },
+    tags=["Devices"],
+)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def get_stream_status(request):
+    mac_address = request.query_params.get("mac_address")
+
+    if not mac_address:
+        return Response(
+            {"error": "MAC address is required"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    if not MAC_ADDRESS_PATTERN.match(mac_address):
+        return Response(
+            {"error": "Invalid MAC address format. Use format XX:XX:XX:XX:XX:XX"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        device = Device.objects.get(mac_address=mac_address)
+    except Device.DoesNotExist:
+        return Response({"error": "Device not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    stream_ids = device_stream_ids(device)
+    sessions = [
+        session
+        for session in read_status(settings.STREAM_STATUS_FOLDER)["sessions"]
+        if session["device_id"] in stream_ids
+    ]
+    return Response(
+        {
+            "mac_address": device.mac_address,
+            "streaming": any(not session["stale"] for session in sessions),
+            "sessions": sessions,
+        }
+    )
@@ -4,37 +4,167 @@ import numpy as np
 import json
 import os
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, deque
+from functools import partial
 import threading
-from queue import Queue
 import time
 import logging
 from django.conf import settings
 import ssl
+from ingest.pipeline import ShardedWorkerPool, BACKPRESSURE_POLICIES
+from ingest.assembly import SEGMENT_FRAMES, VideoAssembler
+from ingest.pairing import FramePairingBuffer, PendingBudget
+from ingest.envelope import decode_envelope, iter_batch
+from ingest.ownership import SessionLease, owner_of
+from ingest.storage import STORAGE_BACKENDS, create_store
+from ingest.segments import DEFAULT_SEGMENT_SIZE
+from ingest.encoder import IncrementalVideoEncoder
+from ingest.hls import find_ffmpeg
+from ingest.metrics import PipelineMetrics, start_metrics_server
+from ingest.status import status_filename, write_status
+from ingest.deadlines import DeadlineTracker
+from ingest.journal import COMPACT_AFTER, SessionJournal, journal_filename
+from ingest.logs import ErrorLog, SummaryLog
+from ingest.preview import PREVIEW_FRAMES, PreviewRelay, start_preview_server
+from ingest.transform import FrameBufferPool, TransformPool
 
-logger = logging.getLogger()
-
-logger.setLevel(logging.DEBUG)
+logger = logging.getLogger("extractor")
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
 
+# "passthrough" stores the received JPEG bytes untouched, "decode" re-encodes
+# every frame at its original_shape
+STORAGE_MODES = ("passthrough", "decode")
+
+MESSAGE_KINDS = ("metadata", "frame", "envelope", "batch")
+
+# "threads" runs paho's loop_forever and the worker pools below, "asyncio"
+# the event loop engine in ingest.async_engine; both write the same files
+ENGINES = ("threads", "asyncio")
+
+# Rolling stream stats cover the frames of the last ROLLING_WINDOW seconds
+ROLLING_WINDOW = 5.0
+ROLLING_FRAMES = 256
+
+# Pairing expiry and status snapshots run at most this often
+HOUSEKEEPING_INTERVAL = 1.0
+
+# Tracker creation and removal lock one of these stripes, chosen by session
+TRACKER_LOCK_STRIPES = 64
+
+# A live encoder is finalized once its stream has been quiet for this many
+# of its own frame intervals, and at least encoder_idle_timeout seconds
+IDLE_FRAME_INTERVALS = 10
+
 
 class DeviceStreamTracker:
-    """Track statistics and status for each device stream"""
+    """Track statistics and status for one device stream session"""
+
+    # Thousands of sessions can be tracked at once; keep each one small
+    __slots__ = (
+        "device_id",
+        "timestamp",
+        "video_info",
+        "frames_received",
+        "last_frame_number",
+        "last_frame_time",
+        "start_time",
+        "status",
+        "pairing",
+        "stats_lock",
+        "queue_depth",
+        "frames_dropped",
+        "metadata_dropped",
+        "arrivals",
+        "metrics",
+    )
 
-    def __init__(self, device_id, video_info=None):
+    def __init__(
+        self,
+        device_id,
+        timestamp=None,
+        video_info=None,
+        max_pending=64,
+        pairing_ttl=5.0,
+        parent_metrics=None,
+        budget=None,
+    ):
         self.device_id = device_id
+        self.timestamp = timestamp
         self.video_info = video_info
         self.frames_received = 0
+        self.last_frame_number = None
         self.last_frame_time = None
         self.start_time = datetime.now()
         self.status = "active"
-        self.frames_buffer = {}
-        self.metadata_queue = Queue()
+        self.pairing = FramePairingBuffer(
+            max_pending=max_pending, ttl=pairing_ttl, budget=budget
+        )
+        # Pipeline counters, updated from the MQTT thread and the workers
+        self.stats_lock = threading.Lock()
+        self.queue_depth = 0
+        self.frames_dropped = 0
+        self.metadata_dropped = 0
+        # (monotonic arrival time, bytes) of the most recent frames
+        self.arrivals = deque(maxlen=ROLLING_FRAMES)
+        # Stage timings and counters, also folded into the process-wide metrics
+        self.metrics = PipelineMetrics(parent=parent_metrics)
 
-    def update_stats(self):
-        self.frames_received += 1
-        self.last_frame_time = datetime.now()
+    @property
+    def stream_key(self):
+        return self.device_id, self.timestamp
+
+    def release(self):
+        """Free the frames still waiting for a pair once the session is done"""
+        self.pairing.clear()
+        self.status = "finalized"
+
+    def update_stats(self, frame_bytes=0):
+        with self.stats_lock:
+            self.frames_received += 1
+            self.last_frame_time = datetime.now()
+            self.arrivals.append((time.monotonic(), frame_bytes))
+
+    def rolling_stats(self, now=None):
+        """fps, inter-frame jitter and bytes/s over the last ROLLING_WINDOW seconds"""
+        now = now or time.monotonic()
+        with self.stats_lock:
+            arrivals = list(self.arrivals)
+        recent = [arrival for arrival in arrivals if now - arrival[0] <= ROLLING_WINDOW]
+        stats = {
+            "fps": 0.0,
+            "jitter_ms": None,
+            "bytes_per_second": 0.0,
+            "seconds_since_last_frame": now - arrivals[-1][0] if arrivals else None,
+        }
+        if len(recent) < 2:
+            return stats
+        span = recent[-1][0] - recent[0][0]
+        if span <= 0:
+            return stats
+        intervals = [b[0] - a[0] for a, b in zip(recent, recent[1:])]
+        mean = span / len(intervals)
+        variance = sum((interval - mean) ** 2 for interval in intervals)
+        variance /= len(intervals)
+        stats.update(
+            fps=len(intervals) / span,
+            jitter_ms=variance**0.5 * 1000,
+            bytes_per_second=sum(size for _, size in recent[1:]) / span,
+        )
+        return stats
+
+    def enqueued(self):
+        with self.stats_lock:
+            self.queue_depth += 1
+
+    def dequeued(self, dropped=None):
+        """Account for an item leaving a queue, optionally because it was dropped"""
+        with self.stats_lock:
+            self.queue_depth -= 1
+            if dropped == "metadata":
+                self.metadata_dropped += 1
+            elif dropped == "frame":
+                self.frames_dropped += 1
 
     def get_status_report(self):
         current_time = datetime.now()
@@ -42,13 +172,26 @@ class DeviceStreamTracker:
             (current_time - self.last_frame_time).seconds if self.last_frame_time else 0
         )
 
-        return {
+        report = {
             "device_id": self.device_id,
+            "timestamp": self.timestamp,
             "frames_received": self.frames_received,
             "stream_duration": str(current_time - self.start_time),
             "status": "inactive" if time_since_last_frame > 10 else "active",
             "video_info": self.video_info,
+            "queue_depth": self.queue_depth,
+            "frames_dropped": self.frames_dropped,
+            "metadata_dropped": self.metadata_dropped,
+            "pending_pairs": len(self.pairing),
+            "orphaned_frames": self.pairing.orphaned,
+            "evicted_frames": self.pairing.evicted,
+            "duplicate_frames": self.pairing.duplicates,
+            "budget_evicted_frames": self.pairing.budget_evicted,
+            "pending_bytes": self.pairing.pending_bytes,
+            "metrics": self.metrics.summary(),
         }
+        report.update(self.rolling_stats())
+        return report
 
 
 class MultiDeviceVideoSubscriber:
@@ -61,8 +204,44 @@ class MultiDeviceVideoSubscriber:
         base_output_folder=os.path.join(settings.MEDIA_ROOT, "received_frames"),
         username=None,
         password=None,
+        storage_mode="passthrough",
+        decode_workers=2,
+        write_workers=2,
+        transform_workers=None,
+        queue_size=256,
+        backpressure="block",
+        live_encoding=True,
+        encoder_idle_timeout=0.5,
+        reorder_window=8,
+        assembly_workers=1,
+        build_segment_frames=SEGMENT_FRAMES,
+        max_pending_frames=64,
+        pairing_ttl=5.0,
+        share_group=None,
+        worker_index=0,
+        worker_count=1,
+        client=None,
+        storage_backend="files",
+        segment_size=DEFAULT_SEGMENT_SIZE,
+        metrics_port=None,
+        status_interval=2.0,
+        max_pending_bytes=256 * 1024 * 1024,
+        device_registry=None,
+        preview_port=None,
+        preview_frames=PREVIEW_FRAMES,
+        hls_time=None,
     ):
-        self.client = mqtt_client.Client()
+        if storage_mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode: {storage_mode}")
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {backpressure}")
+        if storage_backend not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown storage backend: {storage_backend}")
+
+        if not 0 <= worker_index < worker_count:
+            raise ValueError(f"worker_index must be in [0, {worker_count})")
+
+        self.client = client or mqtt_client.Client()
         self.broker_address = broker_address
         self.broker_port = broker_port
         self.topic = topic
@@ -70,45 +249,164 @@ class MultiDeviceVideoSubscriber:
         self.username = username
         self.password = password
         self.stream_timeout = stream_timeout
+        self.storage_mode = storage_mode
+        self.store = create_store(storage_backend, segment_size)
+        self.live_encoding = live_encoding
+        self.encoder_idle_timeout = encoder_idle_timeout
+        self.reorder_window = reorder_window
+        # Seconds per segment of the live encoders' HLS output (None: off)
+        if hls_time and not find_ffmpeg():
+            logger.warning("ffmpeg not found, live HLS output disabled")
+            hls_time = None
+        self.hls_time = hls_time
+        self.max_pending_frames = max_pending_frames
+        self.pairing_ttl = pairing_ttl
+        # Caps the unpaired frames held across all sessions
+        self.pending_budget = PendingBudget(max_pending_bytes)
+        # Devices allowed to stream (device.registry.DeviceRegistry); None
+        # accepts any device_id
+        self.device_registry = device_registry
+
+        # Horizontal scaling: each device is pinned to one worker, which
+        # subscribes to the topics of its own devices only (see
+        # update_subscriptions), so a stream's messages reach one worker in
+        # the order the broker received them. A lease file in each session
+        # folder says which worker finalizes it.
+        self.share_group = share_group
+        self.worker_index = worker_index
+        self.worker_count = worker_count
+        # Topic filters currently subscribed to
+        self.subscriptions = set()
+        self.subscription_lock = threading.Lock()
+        self.leases = (
+            SessionLease(f"{share_group}-{worker_index}") if share_group else None
+        )
+
+        # Process-wide stage timings and counters, scraped from metrics_port
+        self.metrics = PipelineMetrics()
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        # Status snapshot for the stream status API, rewritten every
+        # status_interval seconds by the monitor thread (0 disables it)
+        self.status_interval = status_interval
+        self.status_filename = status_filename(worker_index, worker_count)
+        self.last_status_publish = 0
+        # Last frames of each session, streamed as MJPEG from preview_port
+        self.preview = PreviewRelay(preview_frames) if preview_port else None
+        self.preview_port = preview_port
+        self.preview_server = None
+        # Per-device errors are logged at most once a minute each, and
+        # activity as one summary line a minute
+        self.errors = ErrorLog(logger)
+        self.summary = SummaryLog(logger)
 
         # Create base output folder
         os.makedirs(base_output_folder, exist_ok=True)
+        # Which sessions are open, so a restart can pick them up again
+        self.journal = SessionJournal(
+            base_output_folder, journal_filename(worker_index, worker_count)
+        )
 
-        # Dictionary to track each device's stream
+        # Trackers per (device_id, timestamp) session, freed once it completes
         self.device_trackers = {}
-        self.active_streams = {}
-        # Lock for thread-safe operations
-        self.lock = threading.Lock()
+        # Stream and live encoder inactivity deadlines; frames refresh them
+        # without taking any lock. An encoder's deadline is only when its
+        # stream is next checked for idleness (see encoder_idle)
+        self.active_streams = DeadlineTracker(stream_timeout)
+        self.encoder_deadlines = DeadlineTracker(encoder_idle_timeout)
+        self.output_folders = set()
+        # Live encoders per (device_id, timestamp), and sessions whose frames
+        # kept arriving after their encoder was finalized
+        self.encoders = {}
+        self.rebuild_streams = set()
+        # Full rebuilds run in worker processes, never on the monitor thread
+        self.assembler = VideoAssembler(
+            max_workers=assembly_workers,
+            on_finished=self.video_built,
+            segment_frames=build_segment_frames,
+        )
+        # Looking up an existing tracker is a plain dict read; creating or
+        # removing one locks only its session's stripe, so sessions never
+        # wait on each other
+        self.tracker_locks = [threading.Lock() for _ in range(TRACKER_LOCK_STRIPES)]
         # Start status monitoring thread
         self.running = True
         self.monitor_thread = threading.Thread(target=self.monitor_streams)
+        # Wakes the monitor early, when a deadline earlier than the one it
+        # sleeps towards is registered, or on stop()
+        self.wakeup = threading.Event()
+        self.last_housekeeping = 0
+
+        # The MQTT callback only queues messages; parsing and pairing happen
+        # on the decode workers and disk I/O on the write workers. Both pools
+        # are sharded by (device_id, timestamp) to keep each stream in order.
+        # Pixel work in between runs on the transform pool, one thread per
+        # core by default, which parallelizes even within a stream and puts
+        # frames back in order before they are written.
+        self.decode_pool = ShardedWorkerPool(
+            "decode",
+            self.decode_message,
+            workers=decode_workers,
+            maxsize=queue_size,
+            policy=backpressure,
+            on_drop=self.drop_message,
+        )
+        self.frame_buffers = FrameBufferPool()
+        self.transform_pool = TransformPool(
+            "transform",
+            self.transform_frame,
+            self.queue_write,
+            workers=transform_workers,
+            maxsize=queue_size,
+            policy=backpressure,
+            on_drop=self.drop_write,
+        )
+        self.write_pool = ShardedWorkerPool(
+            "write",
+            self.write_frame,
+            workers=write_workers,
+            maxsize=queue_size,
+            policy=backpressure,
+            on_drop=self.drop_write,
+        )
 
         self.setup_mqtt()
+        self.recover_sessions()
+
+    def recover_sessions(self):
+        """Resume or finalize the sessions a previous run left open.
+
+        The frames a session wrote before the restart never reach a live
+        encoder again, so its video is rebuilt from disk once it times out,
+        which for a session that stopped during the restart is right away.
+        """
+        for state in self.journal.pending():
+            stream_key = (state["device_id"], state["timestamp"])
+            if state["finalized"]:
+                # Interrupted while its video was being rebuilt
+                folder_path = os.path.join(self.base_output_folder, *stream_key)
+                self.assembler.submit(stream_key, folder_path)
+            else:
+                self.rebuild_streams.add(stream_key)
+                self.active_streams.touch(stream_key, state["last_seen"])
+            logger.info(
+                "Recovered session %s/%s at frame %s",
+                stream_key[0],
+                stream_key[1],
+                state["last_frame"],
+            )
+        self.journal.compact()
 
     def setup_mqtt(self):
         def on_connect(client, userdata, flags, rc):
             if rc == 0:
-                logging.debug("Connected to MQTT Broker!")
-                # Subscribe to both metadata and frame topics
-                client.subscribe(f"{self.topic}/+/metadata")
-                client.subscribe(f"{self.topic}/+/frame")
+                logger.info("Connected to MQTT broker")
+                self.update_subscriptions(reconnected=True)
             else:
-                logging.debug(f"Failed to connect, return code {rc}")
+                logger.warning("Failed to connect, return code %s", rc)
 
         def on_message(client, userdata, msg):
-            try:
-                # Extract device ID from topic
-                # Expected format: video/stream/{device_id}/metadata or video/stream/{device_id}/frame
-                parts = msg.topic.split("/")
-                logger.debug(f"parts {parts}")
-                device_id, timestamp = parts[2], parts[3]
-                logger.debug(f"{device_id},: {timestamp}")
-                if msg.topic.endswith("/metadata"):
-                    self.handle_metadata(device_id, timestamp, msg.payload)
-                elif msg.topic.endswith("/frame"):
-                    self.handle_frame(device_id, timestamp, msg.payload)
-            except Exception as e:
-                logging.debug(f"Error processing message: {e}")
+            self.route_message(msg.topic, msg.payload, msg.dup)
 
         if self.username and self.password:
             self.client.username_pw_set(self.username, self.password)
@@ -125,197 +423,715 @@ class MultiDeviceVideoSubscriber:
         self.client.on_connect = on_connect
         self.client.on_message = on_message
 
-    def get_device_tracker(self, device_id, timestamp, video_info=None):
-        """Get or create device tracker"""
-        with self.lock:
-            if device_id not in self.device_trackers:
-                # Create timestamp-based subdirectory for new stream
+    def device_filters(self, device_id="+"):
+        """Topic filters of a device's metadata, frame, envelope and batch messages"""
+        return [
+            f"{self.topic}/{device_id}/+/{kind}"
+            for kind in ("metadata", "frame", "frame/+", "envelope", "batch")
+        ]
 
-                device_folder = os.path.join(
-                    self.base_output_folder, device_id, timestamp
-                )
-                os.makedirs(device_folder, exist_ok=True)
+    def owned_devices(self):
+        """Stream ids of the registered devices pinned to this worker.
 
+        None if this worker takes every device: it is the only one, or
+        the device registry has not loaded yet.
+        """
+        if self.worker_count == 1 or self.device_registry is None:
+            return None
+        stream_ids = self.device_registry.stream_ids
+        if stream_ids is None:
+            return None
+        return {
+            stream_id
+            for stream_id in stream_ids
+            if owner_of(stream_id, self.worker_count) == self.worker_index
+        }
+
+    def update_subscriptions(self, reconnected=False):
+        """Subscribe to the topics of this worker's devices, and only those.
+
+        With several workers, each subscribes per device to the devices it
+        owns, through the share group if there is one, so during a
+        rebalance a message still reaches only one of the workers claiming
+        its device. Until the device list is known every worker subscribes
+        to all devices, unshared, and route_message drops the messages of
+        devices pinned elsewhere.
+        """
+        devices = self.owned_devices()
+        shared = self.share_group and (devices is not None or self.worker_count == 1)
+        prefix = f"$share/{self.share_group}/" if shared else ""
+        wanted = set()
+        for device_id in sorted(devices) if devices is not None else ["+"]:
+            wanted.update(prefix + f for f in self.device_filters(device_id))
+        with self.subscription_lock:
+            if reconnected:
+                # The broker kept none of them
+                self.subscriptions = set()
+            # Subscribe first, so no message falls between the two
+            for topic_filter in sorted(wanted - self.subscriptions):
+                self.client.subscribe(topic_filter)
+            for topic_filter in sorted(self.subscriptions - wanted):
+                self.client.unsubscribe(topic_filter)
+            self.subscriptions = wanted
+
+    def route_message(self, topic, payload, redelivered=False):
+        """Submit a message, unless its device is pinned to another worker"""
+        if self.worker_count > 1:
+            device_id = topic[len(self.topic) + 1 :].split("/", 1)[0]
+            if owner_of(device_id, self.worker_count) != self.worker_index:
+                # Subscribed to every device until the registry loads
+                return
+        self.submit_message(topic, payload, redelivered)
+
+    def submit_message(self, topic, payload, redelivered=False):
+        """Hand a received message off to the decode workers"""
+        received = time.perf_counter()
+        try:
+            # Extract device ID from topic
+            # Expected format: video/stream/{device_id}/{timestamp}/metadata, video/stream/{device_id}/{timestamp}/frame[/{frame_id}]
+            # or video/stream/{device_id}/{timestamp}/envelope|batch
+            parts = topic[len(self.topic) + 1 :].split("/")
+            device_id, timestamp, kind = parts[0], parts[1], parts[2]
+            frame_id = parts[3] if len(parts) > 3 else None
+            if kind not in MESSAGE_KINDS:
+                return
+            if not self.device_registered(device_id):
+                return
+
+            tracker = self.get_device_tracker(device_id, timestamp)
+            tracker.metrics.count("bytes", len(payload))
+            # Any message keeps the session alive, so trackers of sessions
+            # that never produce a frame are freed too
+            self.active_streams.touch(tracker.stream_key)
+            self.queue_message(tracker, (tracker, kind, payload, frame_id, redelivered))
+            # Includes any time spent blocked on a full decode queue
+            tracker.metrics.since("receive", received)
+        except Exception as e:
+            self.errors.log(
+                None, "receive", "Error processing message on %s: %s", topic, e
+            )
+            self.metrics.error("receive")
+
+    def device_registered(self, device_id):
+        """Whether to accept a device's messages; counts the ones refused"""
+        if self.device_registry is None or self.device_registry.is_registered(
+            device_id
+        ):
+            return True
+        self.device_registry.reject()
+        self.errors.log(
+            device_id,
+            "unregistered",
+            "Dropping messages from unregistered device %s",
+            device_id,
+        )
+        return False
+
+    def queue_message(self, tracker, item):
+        """Hand a message to the decode workers"""
+        tracker.enqueued()
+        self.decode_pool.submit(tracker.stream_key, item)
+
+    def decode_message(self, item):
+        """Decode worker: parse and pair a queued message"""
+        # Queued items carry their tracker, which may have been freed since
+        tracker, kind, payload, frame_id, redelivered = item
+        tracker.dequeued()
+        if kind == "metadata":
+            self.handle_metadata(tracker, payload)
+        elif kind == "envelope":
+            self.handle_envelope(tracker, payload, redelivered)
+        elif kind == "batch":
+            self.handle_batch(tracker, payload, redelivered)
+        else:
+            self.handle_frame(tracker, payload, frame_id, redelivered)
+
+    def drop_message(self, item):
+        tracker, kind = item[0], item[1]
+        tracker.dequeued(dropped="metadata" if kind == "metadata" else "frame")
+        tracker.metrics.count("drops")
+        self.errors.log(
+            tracker.device_id,
+            "drops",
+            "Dropped %s message for device %s",
+            kind,
+            tracker.device_id,
+        )
+
+    def drop_write(self, job):
+        self.release_frame(job)
+        tracker = job["tracker"]
+        tracker.dequeued(dropped="frame")
+        tracker.metrics.count("drops")
+        self.errors.log(
+            tracker.device_id, "drops", "Dropped frame for device %s", tracker.device_id
+        )
+
+    def get_device_tracker(self, device_id, timestamp):
+        """Get or create the tracker of a device stream session"""
+        stream_key = (device_id, timestamp)
+        tracker = self.device_trackers.get(stream_key)
+        if tracker is not None:
+            return tracker
+        with self.tracker_lock(stream_key):
+            tracker = self.device_trackers.get(stream_key)
+            if tracker is None:
                 # Create new tracker
-                self.device_trackers[device_id] = DeviceStreamTracker(
-                    device_id, video_info
+                tracker = DeviceStreamTracker(
+                    device_id,
+                    timestamp,
+                    max_pending=self.max_pending_frames,
+                    pairing_ttl=self.pairing_ttl,
+                    parent_metrics=self.metrics,
+                    budget=self.pending_budget,
                 )
-                logging.debug(f"New device detected: {device_id}")
-                if video_info:
-                    logging.debug(f"Video info: {json.dumps(video_info, indent=2)}")
+                self.device_trackers[stream_key] = tracker
+                self.journal.started(stream_key)
+                logger.debug("New stream detected: %s/%s", device_id, timestamp)
+            return tracker
+
+    def report_error(self, tracker, stage, message, error):
+        """Count a session's error and log it, rate-limited per device and stage"""
+        tracker.metrics.error(stage)
+        self.errors.log(
+            tracker.device_id,
+            stage,
+            "%s for device %s/%s: %s",
+            message,
+            tracker.device_id,
+            tracker.timestamp,
+            error,
+        )
 
-            return self.device_trackers[device_id]
+    def tracker_lock(self, stream_key):
+        return self.tracker_locks[hash(stream_key) % TRACKER_LOCK_STRIPES]
 
-    def handle_metadata(self, device_id, timestamp, payload):
+    def handle_metadata(self, tracker, payload):
         """Handle incoming metadata message"""
         try:
+            started = time.perf_counter()
             metadata = json.loads(payload)
-            tracker = self.get_device_tracker(
-                device_id, timestamp, metadata.get("video_info")
-            )
-
-            frame_id = metadata["frame_id"]
-            if frame_id in tracker.frames_buffer:
-                self.process_frame(
-                    device_id, tracker.frames_buffer[frame_id], timestamp, metadata
+            tracker.metrics.since("parse", started)
+            if tracker.video_info is None and metadata.get("video_info"):
+                tracker.video_info = metadata["video_info"]
+                logger.debug(
+                    "Video info for %s: %s", tracker.device_id, tracker.video_info
                 )
-                del tracker.frames_buffer[frame_id]
-            else:
-                tracker.metadata_queue.put((frame_id, metadata))
+
+            pair = tracker.pairing.add_metadata(metadata)
+            if pair:
+                tracker.metrics.observe("pairing_wait", pair[2])
+                self.process_frame(tracker, pair[0], pair[1])
         except Exception as e:
-            logging.debug(f"Error processing metadata for device {device_id}: {e}")
+            self.report_error(tracker, "parse", "Error processing metadata", e)
 
-    def handle_frame(self, device_id, timestamp, payload):
+    def handle_frame(self, tracker, payload, frame_id=None, redelivered=False):
         """Handle incoming frame data"""
         try:
-            tracker = self.get_device_tracker(device_id, timestamp)
-            frame_data = np.frombuffer(payload, dtype=np.uint8)
+            pair = tracker.pairing.add_frame(payload, frame_id, redelivered)
+            if pair:
+                tracker.metrics.observe("pairing_wait", pair[2])
+                self.process_frame(tracker, pair[0], pair[1])
+        except Exception as e:
+            self.report_error(tracker, "pairing_wait", "Error processing frame", e)
 
-            # Try to get corresponding metadata
-            while not tracker.metadata_queue.empty():
-                _, metadata = tracker.metadata_queue.get()
-                self.process_frame(device_id, frame_data, timestamp, metadata)
-                return
+    def handle_envelope(self, tracker, payload, redelivered=False):
+        """Handle a frame and its metadata sent together as one envelope"""
+        try:
+            started = time.perf_counter()
+            metadata, frame_data = decode_envelope(payload)
+            tracker.metrics.since("parse", started)
+            if tracker.pairing.add_complete(metadata["frame_id"]):
+                self.process_frame(tracker, frame_data, metadata)
+        except Exception as e:
+            self.report_error(tracker, "parse", "Error processing envelope", e)
 
-            # Store frame data if no metadata available
-            tracker.frames_buffer[metadata["frame_id"]] = frame_data
+    def handle_batch(self, tracker, payload, redelivered=False):
+        """Handle several envelopes sent as one message"""
+        try:
+            for envelope in iter_batch(payload):
+                self.handle_envelope(tracker, envelope, redelivered)
         except Exception as e:
-            logging.debug(f"Error processing frame for device {device_id}: {e}")
+            self.report_error(tracker, "parse", "Error processing batch", e)
 
-    def process_frame(self, device_id, frame_data, timestamp, metadata):
+    def process_frame(self, tracker, frame_data, metadata):
         """Process and save frame with its metadata"""
+        device_id, timestamp = tracker.stream_key
         try:
-
-            with self.lock:
-                self.active_streams[(device_id, timestamp)] = time.time()
-                logging.debug(f"Updated stream time for {device_id}/{timestamp}")
-            tracker = self.device_trackers[device_id]
+            if self.active_streams.touch(tracker.stream_key):
+                # A straggler of a session that already completed: track it
+                # again so the session is finalized once more
+                with self.tracker_lock(tracker.stream_key):
+                    tracked = self.device_trackers.setdefault(
+                        tracker.stream_key, tracker
+                    )
+                    if tracked is tracker:
+                        tracker.status = "active"
 
             # Update tracker stats
-            tracker.update_stats()
-
-            # Decode the frame
-            if metadata.get("encoding") == "jpg":
-                frame = cv2.imdecode(frame_data, cv2.IMREAD_COLOR)
-
-                # Resize if frame was compressed
-                if "compressed_shape" in metadata:
-                    frame = cv2.resize(
-                        frame,
-                        (metadata["original_shape"][1], metadata["original_shape"][0]),
-                    )
+            tracker.update_stats(len(frame_data))
+            tracker.metrics.count("frames")
 
             # Generate filename with timestamp and frame number
             frame_timestamp = datetime.fromisoformat(metadata["timestamp"])
             frame_number = metadata.get("frame_number", tracker.frames_received)
+            tracker.last_frame_number = frame_number
             filename = (
                 f"{frame_timestamp.strftime('%Y%m%d_%H%M%S')}_frame{frame_number}.jpg"
             )
 
-            # Save to device-specific folder
-            device_folder = os.path.join(self.base_output_folder, device_id, timestamp)
-            os.makedirs(device_folder, exist_ok=True)
-            filepath = os.path.join(device_folder, filename)
-
-            # Save the frame
-            cv2.imwrite(filepath, frame)
-
-            # Save metadata
-            metadata_filename = f"{os.path.splitext(filename)[0]}_metadata.json"
-            metadata_filepath = os.path.join(device_folder, metadata_filename)
-            with open(metadata_filepath, "w") as f:
-                json.dump(metadata, f, indent=4)
-
-            # logging.debug progress if available
-            if "progress_percentage" in metadata:
-                logging.debug(
-                    f"Device {device_id} - Progress: {metadata['progress_percentage']}%"
+            passthrough = (
+                self.storage_mode == "passthrough" and metadata.get("encoding") == "jpg"
+            )
+            if passthrough:
+                # Keep the JPEG exactly as received; upscaling to original_shape
+                # is deferred to whoever needs the pixels (see load_frame)
+                metadata = dict(
+                    metadata,
+                    stored_shape=metadata.get(
+                        "compressed_shape", metadata.get("original_shape")
+                    ),
                 )
+            if self.preview is not None and metadata.get("encoding") == "jpg":
+                self.preview.publish(tracker.stream_key, frame_data)
+            job = {
+                "tracker": tracker,
+                "device_id": device_id,
+                "timestamp": timestamp,
+                "filename": filename,
+                "frame_number": frame_number,
+                "metadata": metadata,
+                "data": frame_data,
+                "passthrough": passthrough,
+            }
+            # A live encoder needs the pixels too: have the transform workers
+            # decode them, rather than the write workers
+            self.queue_frame(job, transform=not passthrough or self.live_encoding)
 
         except Exception as e:
-            logging.debug(f"Error saving frame for device {device_id}: {e}")
+            self.report_error(tracker, "decode", "Error queueing frame", e)
+
+    def queue_frame(self, job, transform=True):
+        """Hand a frame to the transform workers, or past them in order"""
+        stream_key = job["tracker"].stream_key
+        if transform:
+            job["tracker"].enqueued()
+            self.transform_pool.submit(stream_key, job)
+        else:
+            # Nothing to transform, but stay in order behind any frame of
+            # this stream that is still on the transform pool
+            self.transform_pool.submit_ready(stream_key, job)
 
-    def build_video(self, device_id, timestamp):
-        """Build video from frames after streaming has stopped"""
+    def transform_frame(self, job):
+        """Transform worker: decode a frame at its original_shape.
+
+        A passthrough frame keeps its JPEG, which is what gets stored; the
+        pixels are for the live encoder. Any other frame is re-encoded to
+        the JPEG stored, here, so the write workers only write.
+        """
+        tracker = job["tracker"]
+        tracker.dequeued()
         try:
-            folder_path = os.path.join(self.base_output_folder, device_id, timestamp)
-            frame_files = sorted(
-                [f for f in os.listdir(folder_path) if f.endswith(".jpg")]
+            started = time.perf_counter()
+            data = job["data"] if job["passthrough"] else job.pop("data")
+            frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                raise ValueError("not a decodable image")
+            decoded = time.perf_counter()
+            tracker.metrics.observe("decode", decoded - started)
+
+            original_shape = job["metadata"].get("original_shape")
+            if original_shape and frame.shape[:2] != tuple(original_shape[:2]):
+                # Resize into a pooled buffer; whoever is last to need the
+                # pixels (the write worker or the live encoder) releases it
+                height, width = original_shape[:2]
+                resized = self.frame_buffers.acquire((height, width, 3))
+                frame = cv2.resize(frame, (width, height), dst=resized)
+                job["release"] = partial(self.frame_buffers.release, resized)
+                tracker.metrics.since("resize", decoded)
+            job["frame"] = frame
+
+            if not job["passthrough"]:
+                started = time.perf_counter()
+                ok, buffer = cv2.imencode(".jpg", frame)
+                if not ok:
+                    raise ValueError("could not encode frame")
+                job["data"] = buffer
+                tracker.metrics.since("reencode", started)
+            return job
+        except Exception as e:
+            self.release_frame(job)
+            self.report_error(
+                tracker, "decode", f"Error decoding frame {job['frame_number']}", e
             )
 
-            if not frame_files:
-                logging.debug(f"No frames found in {folder_path}")
-                return
+    def queue_write(self, job):
+        """Hand a frame, in stream order, to the write workers"""
+        job["tracker"].enqueued()
+        self.write_pool.submit(job["tracker"].stream_key, job)
 
-            # Read first frame to get dimensions
-            first_frame = cv2.imread(os.path.join(folder_path, frame_files[0]))
-            height, width = first_frame.shape[:2]
+    def release_frame(self, job):
+        release = job.pop("release", None)
+        if release:
+            release()
 
-            # Create video writer
-            video_path = os.path.join(folder_path, "output.mp4")
-            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-            out = cv2.VideoWriter(video_path, fourcc, 30.0, (width, height))
+    def write_frame(self, job):
+        """Write worker: save a frame and its metadata to disk"""
+        device_id = job["device_id"]
+        tracker = job["tracker"]
+        tracker.dequeued()
+        stage = "write_image"
+        handed_off = False
+        try:
+            # Save to device-specific folder
+            device_folder = os.path.join(
+                self.base_output_folder, device_id, job["timestamp"]
+            )
+            if device_folder not in self.output_folders:
+                os.makedirs(device_folder, exist_ok=True)
+                self.output_folders.add(device_folder)
+                if self.leases and self.leases.claim(device_folder):
+                    # Taken over from another worker: our live encoder would
+                    # only see the tail of the session
+                    self.rebuild_streams.add((device_id, job["timestamp"]))
 
-            # Add all frames to video
-            for frame_file in frame_files:
-                frame_path = os.path.join(folder_path, frame_file)
-                frame = cv2.imread(frame_path)
-                out.write(frame)
+            self.store.write(device_folder, job, tracker.metrics)
 
-            out.release()
-            logging.debug(f"Video created at {video_path}")
+            if self.live_encoding:
+                stage = "encode"
+                started = time.perf_counter()
+                handed_off = self.encode_frame(job, device_folder)
+                tracker.metrics.since("encode", started)
 
         except Exception as e:
-            logging.debug(f"Error building video: {e}")
+            self.report_error(tracker, stage, "Error saving frame", e)
+        finally:
+            if not handed_off:
+                self.release_frame(job)
+
+    def encode_frame(self, job, device_folder):
+        """Append a written frame to its session's live encoder.
+
+        Returns True if the encoder took the frame, and with it the job's
+        pixel buffer release.
+        """
+        stream_key = (job["device_id"], job["timestamp"])
+        encoder = self.encoders.get(stream_key)
+        if encoder is None:
+            video_path = os.path.join(device_folder, "output.mp4")
+            if stream_key in self.rebuild_streams or os.path.exists(video_path):
+                # Late frames for a session that already has a video
+                self.rebuild_streams.add(stream_key)
+                return False
+            encoder = IncrementalVideoEncoder(
+                video_path, reorder_window=self.reorder_window, hls_time=self.hls_time
+            )
+            self.encoders[stream_key] = encoder
+        # Write workers are sharded by stream, so no other append can race us
+        late_frames = encoder.late_frames
+        appended = encoder.append(
+            job["frame_number"],
+            frame_data=job.get("data"),
+            metadata=job["metadata"],
+            frame=job.get("frame"),
+            release=job.get("release"),
+        )
+        if encoder.late_frames > late_frames:
+            # Skipped by the live video, though written to disk: rebuild it
+            job["tracker"].metrics.count(
+                "late_frames", encoder.late_frames - late_frames
+            )
+            self.rebuild_streams.add(stream_key)
+        if appended:
+            job.pop("release", None)
+        else:
+            # The stream resumed after its video was finalized; rebuild the
+            # whole video from disk once the stream times out
+            self.rebuild_streams.add(stream_key)
+            return False
+        if self.encoder_deadlines.touch(stream_key):
+            self.wakeup.set()
+        return True
+
+    def encoder_idle(self, encoder, now):
+        """Whether a live encoder's stream has paused long enough to finalize.
+
+        The pause is measured against the stream's own cadence, so a slow
+        stream is not cut at every frame; with no cadence yet, against
+        stream_timeout.
+        """
+        if encoder.frame_interval is None:
+            idle_timeout = self.stream_timeout
+        else:
+            idle_timeout = min(
+                self.stream_timeout,
+                max(
+                    self.encoder_idle_timeout,
+                    IDLE_FRAME_INTERVALS * encoder.frame_interval,
+                ),
+            )
+        return encoder.idle_for(now) >= idle_timeout
+
+    def finalize_idle_encoders(self):
+        """Close the containers of streams that have gone quiet"""
+        now = time.time()
+        for stream_key in self.encoder_deadlines.expired(now):
+            encoder = self.encoders.get(stream_key)
+            if encoder is not None and not encoder.finalized:
+                if not self.encoder_idle(encoder, now):
+                    # Quiet, but not for long at this stream's cadence
+                    self.encoder_deadlines.touch(stream_key, now)
+                    continue
+                try:
+                    self.finalize_encoder(stream_key, encoder)
+                except Exception as e:
+                    logger.warning("Error finalizing video for %s: %s", stream_key, e)
+                    self.metrics.error("video_build")
+                    self.rebuild_streams.add(stream_key)
+
+    def flush_encoders(self):
+        """Finalize the live encoders of sessions still open at shutdown"""
+        for stream_key, encoder in list(self.encoders.items()):
+            try:
+                self.finalize_encoder(stream_key, encoder, session_over=True)
+            except Exception as e:
+                logger.warning("Error finalizing video for %s: %s", stream_key, e)
+                self.metrics.error("video_build")
+
+    def finalize_encoder(self, stream_key, encoder, session_over=False):
+        """Finalize a live encoder, timing it as the session's video build.
+
+        An idle stream only has its MP4 closed; its HLS playlist is ended
+        once the session is over.
+        """
+        finalize = encoder.close if session_over else encoder.finalize
+        if encoder.finalized:
+            return finalize()
+        started = time.perf_counter()
+        finalized = finalize()
+        tracker = self.device_trackers.get(stream_key)
+        if finalized and tracker:
+            tracker.metrics.since("video_build", started)
+        return finalized
+
+    def video_built(self, job):
+        """Assembler callback: account for a finished rebuild"""
+        tracker = self.device_trackers.get(job.stream_key)
+        metrics = tracker.metrics if tracker else self.metrics
+        if job.state == "done":
+            # A failed build stays in the journal, to be retried on restart
+            self.journal.video_built(job.stream_key)
+            metrics.observe("video_build", job.finished_at - job.started_at)
+        else:
+            metrics.error("video_build")
+
+    def complete_stream(self, stream_key):
+        """Close a timed-out stream's video, queueing a rebuild if needed"""
+        device_id, timestamp = stream_key
+        folder_path = os.path.join(self.base_output_folder, device_id, timestamp)
+        self.output_folders.discard(folder_path)
+        self.store.close_session(folder_path)
+        try:
+            video_pending = False
+            if not os.path.isdir(folder_path):
+                # No frame of this session was ever written
+                return
+            if self.leases and not self.leases.owns(folder_path):
+                # The device moved to another worker, which finalizes the session
+                logger.info("Session %s/%s owned elsewhere", device_id, timestamp)
+                encoder = self.encoders.pop(stream_key, None)
+                if encoder is not None:
+                    encoder.close()
+                self.rebuild_streams.discard(stream_key)
+                return
+
+            encoder = self.encoders.pop(stream_key, None)
+            finalized = encoder is not None and self.finalize_encoder(
+                stream_key, encoder, session_over=True
+            )
+            if not finalized or stream_key in self.rebuild_streams:
+                self.assembler.submit(stream_key, folder_path)
+                video_pending = True
+            self.rebuild_streams.discard(stream_key)
+        finally:
+            self.journal_progress([stream_key])
+            self.journal.finalized(stream_key, video_pending)
+            self.release_tracker(stream_key)
+
+    def release_tracker(self, stream_key):
+        """Free a completed session's tracker and the frames it still buffers"""
+        with self.tracker_lock(stream_key):
+            tracker = self.device_trackers.pop(stream_key, None)
+        if tracker is not None:
+            tracker.release()
+        self.transform_pool.forget(stream_key)
+        if self.preview is not None:
+            self.preview.close(stream_key)
+
+    def journal_progress(self, stream_keys=None):
+        """Journal the sessions that received frames since their last entry"""
+        if stream_keys is None:
+            stream_keys = [stream_key for stream_key, _ in self.active_streams.items()]
+        updates = []
+        for stream_key in stream_keys:
+            tracker = self.device_trackers.get(stream_key)
+            if tracker is None or tracker.last_frame_time is None:
+                continue
+            if tracker.frames_received != self.journal.frames(stream_key):
+                updates.append(
+                    (
+                        stream_key,
+                        tracker.last_frame_number,
+                        tracker.frames_received,
+                        tracker.last_frame_time.timestamp(),
+                    )
+                )
+        self.journal.progress(updates)
+
+    def publish_status(self):
+        """Write the status snapshot served by the stream status API"""
+        now = time.time()
+        if (
+            not self.status_interval
+            or now - self.last_status_publish < self.status_interval
+        ):
+            return
+        self.last_status_publish = now
+        sessions = []
+        # A stream that finishes meanwhile just shows up once more
+        for stream_key, last_seen in self.active_streams.items():
+            tracker = self.device_trackers.get(stream_key)
+            if tracker is None:
+                continue
+            report = tracker.get_status_report()
+            report["last_seen"] = last_seen
+            sessions.append(report)
+        try:
+            write_status(
+                self.base_output_folder,
+                {
+                    "generated_at": now,
+                    "interval": self.status_interval,
+                    "worker": self.worker_index,
+                    "sessions": sessions,
+                    "builds": self.assembler.status(),
+                },
+                self.status_filename,
+            )
+        except OSError as e:
+            logger.warning("Error writing stream status: %s", e)
 
     def monitor_streams(self):
         """Monitor streams and detect when they've stopped"""
         while self.running:
             try:
-                current_time = time.time()
-                with self.lock:
-                    completed_streams = []
+                for stream_key in self.active_streams.expired():
+                    logger.info("Stream timeout detected for %s/%s", *stream_key)
+                    self.complete_stream(stream_key)
 
-                    # Debug output
-                    logging.debug(f"Active streams: {self.active_streams}")
+                self.finalize_idle_encoders()
 
-                    for stream_key, last_frame_time in list(
-                        self.active_streams.items()
+                if time.time() - self.last_housekeeping >= HOUSEKEEPING_INTERVAL:
+                    self.last_housekeeping = time.time()
+                    if (
+                        self.device_registry is not None
+                        and self.device_registry.refresh_if_stale()
                     ):
-                        device_id, timestamp = stream_key
-                        if current_time - last_frame_time > self.stream_timeout:
-                            logging.debug(
-                                f"Stream timeout detected for {device_id}/{timestamp}"
-                            )
-                            completed_streams.append((device_id, timestamp))
-                            self.build_video(device_id, timestamp)
-                            del self.active_streams[stream_key]
+                        self.update_subscriptions()
+                    self.publish_status()
+                    self.journal_progress()
+                    if self.journal.appended >= COMPACT_AFTER:
+                        self.journal.compact()
+                    for tracker in list(self.device_trackers.values()):
+                        tracker.pairing.expire()
+                    self.errors.flush()
+                    self.summary.tick(self.metrics, len(self.device_trackers))
 
             except Exception as e:
-                logging.debug(f"Error in monitor_streams: {e}")
+                logger.warning("Error in monitor_streams: %s", e)
 
-            time.sleep(1)
+            # Sleep until the next deadline that can actually fire
+            self.wakeup.clear()
+            self.wakeup.wait(self.next_wakeup())
+
+    def next_wakeup(self):
+        """Seconds until the monitor has something to do"""
+        due = [self.last_housekeeping + HOUSEKEEPING_INTERVAL]
+        for deadlines in (self.active_streams, self.encoder_deadlines):
+            deadline = deadlines.next_deadline()
+            if deadline is not None:
+                due.append(deadline)
+        return max(0, min(due) - time.time())
 
     def start(self):
         """Start the subscriber"""
         try:
-            # Start monitoring thread
+            # Start monitoring thread and pipeline workers
             self.monitor_thread.start()
+            self.start_pipeline()
+            self.start_servers()
 
             # Connect and start MQTT loop
             self.client.connect(self.broker_address, self.broker_port)
             self.client.loop_forever()
         except KeyboardInterrupt:
-            logging.debug("Stopping subscriber...")
+            logger.info("Stopping subscriber...")
             self.stop()
         except Exception as e:
-            logging.debug(f"Error in subscriber: {e}")
+            logger.error("Error in subscriber: %s", e)
             self.stop()
 
+    def start_servers(self):
+        """Start the metrics and preview HTTP servers, where configured"""
+        if self.metrics_port:
+            self.metrics_server = start_metrics_server(self, self.metrics_port)
+        if self.preview_port:
+            self.preview_server = start_preview_server(self.preview, self.preview_port)
+
+    def start_pipeline(self):
+        """Start the decode, transform and write workers"""
+        self.write_pool.start()
+        self.transform_pool.start()
+        self.decode_pool.start()
+
+    def drain_pipeline(self):
+        """Stop the workers once everything queued has been written"""
+        self.decode_pool.stop()
+        self.transform_pool.stop()
+        self.write_pool.stop()
+
+    def disconnect(self):
+        """Stop receiving messages"""
+        self.client.loop_stop()
+        self.client.disconnect()
+
     def stop(self):
         """Stop the subscriber"""
         self.running = False
+        self.wakeup.set()
         if self.monitor_thread.is_alive():
             self.monitor_thread.join()
-        self.client.loop_stop()
-        self.client.disconnect()
+        self.disconnect()
+        # Drain whatever is still queued before returning
+        self.drain_pipeline()
+        self.flush_encoders()
+        self.journal_progress()
+        self.store.close()
+        self.assembler.shutdown()
+        self.journal.close()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        if self.preview_server:
+            self.preview.close_all()
+            self.preview_server.shutdown()
+
+
+def create_subscriber(engine="threads", **options):
+    """Build a subscriber running on the given ingest engine"""
+    if engine == "asyncio":
+        from ingest.async_engine import AsyncVideoSubscriber
+
+        return AsyncVideoSubscriber(**options)
+    if engine == "threads":
+        return MultiDeviceVideoSubscriber(**options)
+    raise ValueError(f"Unknown ingest engine: {engine}")
@@ -0,0 +1,435 @@
+"""Session video builds, run in background worker processes.
+
+A short session is built by build_video, one sequential decode and
+encode loop. A session longer than segment_frames is split instead: its
+ordered frames are cut into chunks of segment_frames, each chunk is
+encoded to its own MP4 by build_segment on any free worker process, and
+concat_segments joins the chunks with ffmpeg's concat demuxer without
+re-encoding. Chunks of one session encode in parallel, so the build time
+of a long session shrinks with the number of assembly workers. Without
+ffmpeg, or if a chunk or the concatenation fails, the session is built
+sequentially instead.
+"""
+
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import cv2
+
+from ingest.encoder import VIDEO_FPS
+from ingest.frames import decode_frame, load_frame, sorted_frame_files
+from ingest.hls import find_ffmpeg
+from ingest.segments import SegmentReader, has_segments
+
+logger = logging.getLogger(__name__)
+
+# "interrupted": left unfinished by shutdown(), for the next run to rebuild
+JOB_STATES = ("queued", "running", "done", "failed", "interrupted")
+
+# Frames per chunk of a parallel build; 1 minute at VIDEO_FPS
+SEGMENT_FRAMES = 1800
+
+# Chunks of a parallel build, removed once they are joined
+BUILD_FOLDER = ".build"
+
+
+def iter_session_frames(folder_path, start=0, stop=None):
+    """Yield a session's decoded frames in frame_number order.
+
+    Works for both storage layouts; frames stored in passthrough mode are
+    upscaled to their original_shape. start and stop select a slice of
+    the ordered frames.
+    """
+    if has_segments(folder_path):
+        reader = SegmentReader(folder_path)
+        try:
+            for frame_number in reader.frame_numbers()[start:stop]:
+                yield decode_frame(
+                    reader.read_frame(frame_number),
+                    reader.read_metadata(frame_number),
+                )
+        finally:
+            reader.close()
+    else:
+        for frame_file in sorted_frame_files(folder_path)[start:stop]:
+            yield load_frame(os.path.join(folder_path, frame_file))
+
+
+def count_session_frames(folder_path):
+    if has_segments(folder_path):
+        reader = SegmentReader(folder_path)
+        try:
+            return len(reader)
+        finally:
+            reader.close()
+    return len(sorted_frame_files(folder_path))
+
+
+def build_video(folder_path, fps=VIDEO_FPS):
+    """Build output.mp4 from the frames stored in folder_path"""
+    video_path = os.path.join(folder_path, "output.mp4")
+    # Written aside and renamed, so a reader never sees a half-built video
+    partial_path = os.path.join(folder_path, "output.build.mp4")
+    out = None
+    size = None
+
+    for frame in iter_session_frames(folder_path):
+        if frame is None:
+            continue
+        if out is None:
+            # The first frame sets the video dimensions
+            height, width = frame.shape[:2]
+            size = (width, height)
+            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+            out = cv2.VideoWriter(partial_path, fourcc, fps, size)
+        if (frame.shape[1], frame.shape[0]) != size:
+            frame = cv2.resize(frame, size)
+        out.write(frame)
+
+    if out is None:
+        logger.info("No frames found in %s", folder_path)
+        return None
+
+    out.release()
+    os.replace(partial_path, video_path)
+    logger.info("Video created at %s", video_path)
+    return video_path
+
+
+def plan_build(folder_path):
+    """Frame count and video size of a session; the size is None without frames"""
+    for frame in iter_session_frames(folder_path):
+        if frame is not None:
+            # The first frame sets the video dimensions, as in build_video
+            return count_session_frames(folder_path), (frame.shape[1], frame.shape[0])
+    return 0, None
+
+
+def build_segment(folder_path, segment_path, start, stop, size, fps=VIDEO_FPS):
+    """Encode frames [start, stop) of a session; None if none decoded"""
+    out = None
+    for frame in iter_session_frames(folder_path, start, stop):
+        if frame is None:
+            continue
+        if out is None:
+            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+            out = cv2.VideoWriter(segment_path, fourcc, fps, size)
+        if (frame.shape[1], frame.shape[0]) != size:
+            frame = cv2.resize(frame, size)
+        out.write(frame)
+    if out is None:
+        return None
+    out.release()
+    return segment_path
+
+
+def concat_segments(folder_path, segment_paths):
+    """Join encoded chunks into output.mp4 without re-encoding them"""
+    video_path = os.path.join(folder_path, "output.mp4")
+    build_folder = os.path.join(folder_path, BUILD_FOLDER)
+    list_path = os.path.join(build_folder, "segments.txt")
+    partial_path = os.path.join(build_folder, "output.mp4")
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            f.write(f"file '{os.path.basename(path)}'\n")
+    subprocess.run(
+        [
+            find_ffmpeg() or "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_path,
+            "-c",
+            "copy",
+            partial_path,
+        ],
+        check=True,
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+    )
+    os.replace(partial_path, video_path)
+    shutil.rmtree(build_folder, ignore_errors=True)
+    logger.info("Video created at %s (%d segments)", video_path, len(segment_paths))
+    return video_path
+
+
+def _lower_priority(niceness):
+    """Worker initializer: keep builds from competing with live ingest"""
+    try:
+        os.nice(niceness)
+    except (AttributeError, OSError):
+        pass
+
+
+class AssemblyJob:
+    """State and timings of one video build"""
+
+    def __init__(self, stream_key, folder_path):
+        self.stream_key = stream_key
+        self.folder_path = folder_path
+        self.state = "queued"
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.video_path = None
+        self.error = None
+        # Chunks of a parallel build, in frame order: their paths once
+        # built, None before (or if no frame of the chunk decoded)
+        self.segments = []
+        self.segments_done = 0
+        self.segment_error = None
+
+    def as_dict(self):
+        return {
+            "device_id": self.stream_key[0],
+            "timestamp": self.stream_key[1],
+            "state": self.state,
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wait_time": (self.started_at or time.time()) - self.queued_at,
+            "build_time": (
+                (self.finished_at or time.time()) - self.started_at
+                if self.started_at
+                else None
+            ),
+            "video_path": self.video_path,
+            "error": self.error,
+            "segments_total": len(self.segments),
+            "segments_done": self.segments_done,
+        }
+
+
+class VideoAssembler:
+    """Build session videos in background worker processes.
+
+    At most max_workers builds run at once; further jobs wait in a queue
+    owned by this object, so a job's state is always known precisely.
+    Workers run at a lower CPU priority than the ingest process. The
+    chunks of a long session's build are spread over all max_workers
+    processes, and the job reports how many of them are done.
+    """
+
+    def __init__(
+        self,
+        max_workers=1,
+        fps=VIDEO_FPS,
+        niceness=10,
+        history=100,
+        on_finished=None,
+        segment_frames=SEGMENT_FRAMES,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.fps = fps
+        # Sessions longer than this are built in parallel chunks (0: never)
+        self.segment_frames = segment_frames if find_ffmpeg() else 0
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_lower_priority,
+            initargs=(niceness,),
+        )
+        self.lock = threading.Lock()
+        self.queued = deque()
+        self.running = 0
+        self.jobs = OrderedDict()
+        self.history = history
+        # Called with each AssemblyJob once it is done or failed, never for
+        # a job shutdown() interrupted
+        self.on_finished = on_finished
+        self.closed = False
+
+    def submit(self, stream_key, folder_path):
+        """Queue a build for a finished stream"""
+        job = AssemblyJob(stream_key, folder_path)
+        with self.lock:
+            self.jobs.pop(stream_key, None)
+            self.jobs[stream_key] = job
+            while len(self.jobs) > self.history:
+                oldest_key, oldest = next(iter(self.jobs.items()))
+                if oldest.state in ("queued", "running"):
+                    break
+                del self.jobs[oldest_key]
+            self.queued.append(job)
+        self._dispatch()
+        return job
+
+    def status(self):
+        """Snapshot of all tracked jobs"""
+        with self.lock:
+            return [job.as_dict() for job in self.jobs.values()]
+
+    def shutdown(self, wait=True):
+        """Stop building; jobs not done by then are left interrupted.
+
+        Queued jobs are not started, and a parallel build stops once the
+        chunks already running are done; the chunks it had yet to start are
+        cancelled. Their sessions stay pending in the journal.
+        """
+        with self.lock:
+            self.closed = True
+            for job in self.queued:
+                job.state = "interrupted"
+            self.queued.clear()
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _dispatch(self):
+        started = []
+        with self.lock:
+            while self.queued and self.running < self.max_workers and not self.closed:
+                job = self.queued.popleft()
+                job.state = "running"
+                job.started_at = time.time()
+                self.running += 1
+                started.append(job)
+        for job in started:
+            if self.segment_frames:
+                self._submit(job, self._planned, plan_build, job.folder_path)
+            else:
+                self._build_sequentially(job)
+
+    def _submit(self, job, callback, fn, *args):
+        """Run one step of a job's build, then callback(job, future)"""
+        try:
+            future = self.executor.submit(fn, *args)
+        except RuntimeError:
+            # Shut down between two steps of the build
+            self._interrupt(job)
+            return
+        future.add_done_callback(
+            lambda future, job=job: (
+                self._interrupt(job) if future.cancelled() else callback(job, future)
+            )
+        )
+
+    def _interrupt(self, job):
+        with self.lock:
+            # The chunks of a parallel build may each report it
+            if job.state != "running":
+                return
+            job.state = "interrupted"
+            self.running -= 1
+        logger.info("Video build for %s/%s interrupted", *job.stream_key)
+
+    def _build_sequentially(self, job):
+        self._submit(job, self._finished, build_video, job.folder_path, self.fps)
+
+    def _planned(self, job, future):
+        try:
+            frame_count, size = future.result()
+        except Exception as e:
+            self._complete(job, error=e)
+            return
+        if frame_count <= self.segment_frames:
+            self._build_sequentially(job)
+            return
+        build_folder = os.path.join(job.folder_path, BUILD_FOLDER)
+        shutil.rmtree(build_folder, ignore_errors=True)
+        try:
+            os.makedirs(build_folder)
+        except OSError as e:
+            self._fall_back(job, e)
+            return
+        starts = range(0, frame_count, self.segment_frames)
+        job.segments = [None] * len(starts)
+        logger.info("Building %s/%s in %d segments", *job.stream_key, len(job.segments))
+        for index, start in enumerate(starts):
+            self._submit(
+                job,
+                partial(self._segment_built, index=index),
+                build_segment,
+                job.folder_path,
+                os.path.join(build_folder, f"segment_{index:05d}.mp4"),
+                start,
+                min(start + self.segment_frames, frame_count),
+                size,
+                self.fps,
+            )
+
+    def _segment_built(self, job, future, index):
+        try:
+            job.segments[index] = future.result()
+        except Exception as e:
+            job.segment_error = e
+        with self.lock:
+            job.segments_done += 1
+            last = job.segments_done == len(job.segments)
+        logger.debug(
+            "Segment %d of %d of %s/%s built",
+            job.segments_done,
+            len(job.segments),
+            *job.stream_key,
+        )
+        if not last:
+            return
+        segment_paths = [path for path in job.segments if path]
+        if job.segment_error is not None or not segment_paths:
+            self._fall_back(job, job.segment_error)
+            return
+        self._submit(job, self._joined, concat_segments, job.folder_path, segment_paths)
+
+    def _joined(self, job, future):
+        try:
+            video_path = future.result()
+        except Exception as e:
+            self._fall_back(job, e)
+            return
+        self._complete(job, video_path)
+
+    def _fall_back(self, job, error):
+        """Build sequentially after a parallel build failed"""
+        logger.warning(
+            "Parallel build of %s/%s failed (%s), building sequentially",
+            *job.stream_key,
+            (getattr(error, "stderr", None) or str(error)).strip(),
+        )
+        shutil.rmtree(os.path.join(job.folder_path, BUILD_FOLDER), ignore_errors=True)
+        self._build_sequentially(job)
+
+    def _finished(self, job, future):
+        try:
+            video_path = future.result()
+        except Exception as e:
+            self._complete(job, error=e)
+            return
+        self._complete(job, video_path)
+
+    def _complete(self, job, video_path=None, error=None):
+        job.finished_at = time.time()
+        if error is None:
+            job.video_path = video_path
+            job.state = "done"
+            logger.info(
+                "Video build for %s/%s done in %.2fs",
+                *job.stream_key,
+                job.finished_at - job.started_at,
+            )
+        else:
+            job.error = str(error)
+            job.state = "failed"
+            logger.warning("Error building video for %s/%s: %s", *job.stream_key, error)
+        with self.lock:
+            self.running -= 1
+        if self.on_finished:
+            try:
+                self.on_finished(job)
+            except Exception as e:
+                logger.warning(
+                    "Error in build callback for %s/%s: %s", *job.stream_key, e
+                )
+        self._dispatch()
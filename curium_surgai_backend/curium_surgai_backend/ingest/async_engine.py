@@ -0,0 +1,333 @@
+"""Asyncio ingest engine.
+
+AsyncVideoSubscriber runs the handlers of MultiDeviceVideoSubscriber, and
+writes the same files, on one event loop instead of paho's loop_forever
+thread and the decode and write worker pools:
+
+- the paho client's socket is watched with add_reader/add_writer, and
+  loop_misc runs once a second to send keepalives;
+- messages are parsed and paired on the loop itself;
+- decoding and resizing run on a thread pool executor;
+- frame writes, live encoding included, are offloaded with
+  asyncio.to_thread, one at a time per session, so a session's frames
+  land in order while sessions write concurrently.
+
+An idle session costs its tracker and nothing else: a session's writer
+task only exists while it has frames in flight.
+
+    subscriber = create_subscriber("asyncio", broker_address=...)
+    subscriber.start()
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+
+from extractor import MultiDeviceVideoSubscriber
+
+logger = logging.getLogger(__name__)
+
+# Seconds between paho loop_misc() calls, which send keepalive pings
+MISC_INTERVAL = 1.0
+
+# Reconnect backoff, doubled after every failed attempt
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 120.0
+
+
+class AsyncVideoSubscriber(MultiDeviceVideoSubscriber):
+    """MultiDeviceVideoSubscriber driven by an asyncio event loop.
+
+    At most queue_size frames are in flight between pairing and disk. Past
+    that, the block policy stops reading the MQTT socket until frames have
+    been written, and both drop policies drop the incoming frame: frames
+    already handed to an executor cannot be recalled.
+    """
+
+    def __init__(
+        self,
+        *args,
+        write_workers=2,
+        transform_workers=None,
+        queue_size=256,
+        backpressure="block",
+        **kwargs,
+    ):
+        super().__init__(
+            *args,
+            write_workers=write_workers,
+            transform_workers=transform_workers,
+            queue_size=queue_size,
+            backpressure=backpressure,
+            **kwargs,
+        )
+        self.backpressure = backpressure
+        self.max_in_flight = queue_size
+        self.in_flight = 0
+        # Pixel work and blocking file I/O get separate threads, so a slow
+        # disk never holds up decoding
+        self.cpu_executor = ThreadPoolExecutor(
+            transform_workers or os.cpu_count() or 1, thread_name_prefix="transform"
+        )
+        self.io_executor = ThreadPoolExecutor(
+            max(1, write_workers), thread_name_prefix="write"
+        )
+        # stream_key -> (frames waiting to be written, the task writing them)
+        self.sessions = {}
+
+        self.loop = None
+        self.loop_thread = None
+        self.loop_thread_id = None
+        self.stopping = None
+        self.started = threading.Event()
+        self.stopped = threading.Event()
+        # Set while there is room for more frames; under the block policy,
+        # threads delivering messages from outside the loop wait on it
+        self.room = threading.Event()
+        self.room.set()
+        self.sock = None
+        self.reading = False
+        self.misc_task = None
+
+    def setup_mqtt(self):
+        super().setup_mqtt()
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_loop_thread(self, callback, *args):
+        """Whether we are on the loop; if not, have it run callback(*args)"""
+        if threading.get_ident() == self.loop_thread_id:
+            return True
+        self.loop.call_soon_threadsafe(callback, *args)
+        return False
+
+    def on_socket_open(self, client, userdata, sock):
+        # Reconnects run on an executor thread
+        if not self.on_loop_thread(self.on_socket_open, client, userdata, sock):
+            return
+        self.sock = sock
+        self.watch_socket()
+        self.misc_task = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        if not self.on_loop_thread(self.on_socket_close, client, userdata, sock):
+            return
+        if self.reading:
+            self.loop.remove_reader(sock)
+            self.reading = False
+        self.sock = None
+        if self.misc_task:
+            self.misc_task.cancel()
+            self.misc_task = None
+        if not self.stopping.is_set():
+            logger.warning("Lost connection to MQTT broker, reconnecting")
+            self.loop.create_task(self.reconnect())
+
+    def on_socket_register_write(self, client, userdata, sock):
+        if self.on_loop_thread(self.on_socket_register_write, client, userdata, sock):
+            self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        if self.on_loop_thread(
+            self.on_socket_unregister_write, client, userdata, sock
+        ):
+            self.loop.remove_writer(sock)
+
+    def watch_socket(self):
+        """Read the socket unless backpressure has paused reading"""
+        reading = self.sock is not None and self.room.is_set()
+        if reading and not self.reading:
+            self.loop.add_reader(self.sock, self.read_socket)
+            # TLS may hold decrypted data the selector will not report
+            self.loop.call_soon(self.read_socket)
+        elif self.reading and not reading:
+            self.loop.remove_reader(self.sock)
+        self.reading = reading
+
+    def read_socket(self):
+        if not self.reading:
+            return
+        self.client.loop_read()
+        pending = getattr(self.sock, "pending", None)
+        if self.reading and pending and pending():
+            self.loop.call_soon(self.read_socket)
+
+    async def misc_loop(self):
+        while self.client.loop_misc() == MQTT_ERR_SUCCESS:
+            await asyncio.sleep(MISC_INTERVAL)
+
+    async def reconnect(self):
+        delay = RECONNECT_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            if self.stopping.is_set():
+                return
+            try:
+                # DNS, TCP and TLS handshakes block: keep them off the loop
+                await self.loop.run_in_executor(None, self.client.reconnect)
+                return
+            except Exception as e:
+                logger.warning("Error reconnecting to MQTT broker: %s", e)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def route_message(self, topic, payload, redelivered=False):
+        """Handle a message on the event loop, whichever thread delivers it"""
+        if threading.get_ident() == self.loop_thread_id:
+            return super().route_message(topic, payload, redelivered)
+        if self.backpressure == "block":
+            self.room.wait()
+        self.loop.call_soon_threadsafe(
+            super().route_message, topic, payload, redelivered
+        )
+
+    def queue_message(self, tracker, item):
+        """Parse and pair right away; both are cheap next to the pixel work"""
+        tracker.enqueued()
+        self.decode_message(item)
+
+    def queue_frame(self, job, transform=True):
+        """Start a frame's transform and queue it behind its session's frames"""
+        tracker = job["tracker"]
+        if self.in_flight >= self.max_in_flight and self.backpressure != "block":
+            tracker.enqueued()
+            self.drop_write(job)
+            return
+        if transform:
+            tracker.enqueued()
+            pending = self.loop.run_in_executor(
+                self.cpu_executor, self.transform_frame, job
+            )
+        else:
+            pending = self.loop.create_future()
+            pending.set_result(job)
+        self.frame_queued()
+
+        session = self.sessions.get(tracker.stream_key)
+        if session is None:
+            queue = deque()
+            task = self.loop.create_task(self.write_session(tracker.stream_key, queue))
+            session = self.sessions[tracker.stream_key] = (queue, task)
+        session[0].append(pending)
+
+    async def write_session(self, stream_key, queue):
+        """Write a session's frames in the order they arrived.
+
+        Frames are written on one thread hop per batch: whatever is ready
+        by the time the oldest frame is goes to disk with it.
+        """
+        try:
+            while queue:
+                await asyncio.wait([queue[0]])
+                jobs = []
+                while queue and queue[0].done():
+                    job = self.transformed(queue.popleft())
+                    if job is None:
+                        self.frame_done()
+                    else:
+                        job["tracker"].enqueued()
+                        jobs.append(job)
+                if jobs:
+                    await asyncio.to_thread(self.write_frames, jobs)
+                    for _ in jobs:
+                        self.frame_done()
+        finally:
+            del self.sessions[stream_key]
+
+    def transformed(self, pending):
+        """The job a finished transform produced, or None if it failed"""
+        if pending.cancelled():
+            return None
+        if pending.exception() is not None:
+            logger.warning("Error in transform executor: %s", pending.exception())
+            return None
+        return pending.result()
+
+    def write_frames(self, jobs):
+        for job in jobs:
+            self.write_frame(job)
+
+    def frame_queued(self):
+        self.in_flight += 1
+        if self.in_flight >= self.max_in_flight and self.backpressure == "block":
+            self.room.clear()
+            self.watch_socket()
+
+    def frame_done(self):
+        self.in_flight -= 1
+        if self.in_flight < self.max_in_flight and not self.room.is_set():
+            self.room.set()
+            self.watch_socket()
+
+    async def drain(self):
+        """Wait until every frame queued so far has been written"""
+        while self.sessions:
+            await asyncio.wait([task for _, task in self.sessions.values()])
+
+    async def serve(self, connect=True):
+        """Run the engine on the running event loop until stop()"""
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_default_executor(self.io_executor)
+        self.loop_thread_id = threading.get_ident()
+        self.stopping = asyncio.Event()
+        self.stopped.clear()
+        try:
+            if connect:
+                self.client.connect(self.broker_address, self.broker_port)
+            self.started.set()
+            await self.stopping.wait()
+        finally:
+            self.stopping.set()
+            self.client.disconnect()
+            if self.sock is not None:
+                # Send the DISCONNECT now; paho closes the socket after it
+                self.client.loop_write()
+            await self.drain()
+            self.room.set()
+            self.stopped.set()
+
+    def start(self):
+        """Start the subscriber and run the event loop until stop()"""
+        try:
+            self.monitor_thread.start()
+            self.start_servers()
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logger.info("Stopping subscriber...")
+            self.stop()
+        except Exception as e:
+            logger.error("Error in subscriber: %s", e)
+            self.stop()
+
+    def start_pipeline(self):
+        """Run the event loop on a thread of its own, without connecting"""
+        if self.loop_thread:
+            return
+        self.loop_thread = threading.Thread(
+            target=asyncio.run, args=(self.serve(connect=False),), name="ingest-loop"
+        )
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+        self.started.wait()
+
+    def disconnect(self):
+        """Stop receiving messages; serve() disconnects on its way out"""
+        if self.started.is_set() and not self.stopped.is_set():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    def drain_pipeline(self):
+        """Stop the event loop once everything queued has been written"""
+        self.disconnect()
+        if self.started.is_set():
+            self.stopped.wait()
+        if self.loop_thread:
+            self.loop_thread.join()
+            self.loop_thread = None
+        self.cpu_executor.shutdown()
+        self.io_executor.shutdown()
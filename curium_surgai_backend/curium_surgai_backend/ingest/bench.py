@@ -0,0 +1,341 @@
+"""Ingest throughput benchmark for MultiDeviceVideoSubscriber.
+
+Drives the subscriber's message handlers with synthetic device streams,
+either by calling the MQTT entry point directly or through the in-process
+LocalBroker, and sweeps device count, fps, resolution and JPEG quality.
+Every configuration runs in a fresh process so peak RSS is per run.
+
+    python -m ingest.bench --devices 1,4,16 --fps 30 --resolution 640x480 \\
+        --quality 70,90 --duration 5 --output bench.json
+
+Use --baseline with a previous results file to print the change of each
+metric against it. --engine threads|asyncio picks the ingest engine, so
+both can be compared on the same configurations. --log-level INFO or DEBUG
+formats and writes (to os.devnull) every record at that level, to measure
+what logging costs per frame.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+COMPARED_METRICS = (
+    "frames_per_second",
+    "latency_p50_ms",
+    "latency_p99_ms",
+    "cpu_ms_per_frame",
+)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def synthetic_frames(width, height, quality, count=8):
+    """A few distinct JPEGs per stream; noise keeps their size realistic"""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.uint8)[None, :, None]
+    frames = []
+    for index in range(count):
+        image = np.broadcast_to(gradient, (height, width, 3)).copy()
+        image = cv2.add(image, rng.integers(0, 40, image.shape, dtype=np.uint8))
+        cv2.putText(image, str(index), (10, height // 2), 0, 2, (255, 255, 255), 3)
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        frames.append(encoded.tobytes())
+    return frames
+
+
+def folder_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_config(config):
+    """Run one benchmark configuration and return its metrics"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from extractor import MultiDeviceVideoSubscriber
+    from ingest.async_engine import AsyncVideoSubscriber
+    from ingest.envelope import encode_batch, encode_envelope
+    from ingest.local_broker import LocalBroker
+
+    # Records at the configured level are formatted and written as they
+    # would be in production, just not to the console
+    root = logging.getLogger()
+    root.setLevel(config["log_level"])
+    log_sink = logging.StreamHandler(open(os.devnull, "w"))
+    log_sink.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+    )
+    root.addHandler(log_sink)
+
+    width, height = config["resolution"]
+    output_folder = tempfile.mkdtemp(prefix="ingest-bench-")
+    broker = LocalBroker()
+    completed = []
+    completed_lock = threading.Lock()
+    sent_at = {}
+
+    engines = {"threads": MultiDeviceVideoSubscriber, "asyncio": AsyncVideoSubscriber}
+
+    class BenchSubscriber(engines[config["engine"]]):
+        def write_frame(self, job):
+            super().write_frame(job)
+            with completed_lock:
+                completed.append(
+                    time.perf_counter()
+                    - sent_at[(job["device_id"], job["frame_number"])]
+                )
+
+    subscriber = BenchSubscriber(
+        base_output_folder=output_folder,
+        client=broker.client(),
+        **config["subscriber_options"],
+    )
+    subscriber.start_pipeline()
+    if config["transport"] == "broker":
+        subscriber.client.connect()
+        publish = broker.client().publish
+    else:
+        publish = lambda topic, payload: subscriber.route_message(topic, payload)
+
+    frames = synthetic_frames(width, height, config["quality"])
+    devices = [f"bench-{index:04d}" for index in range(config["devices"])]
+    frame_count = int(config["fps"] * config["duration"]) if config["fps"] else 0
+    frame_count = frame_count or config["frames"]
+    start_time = datetime(2024, 1, 1)
+    interval = 1.0 / config["fps"] if config["fps"] else 0
+    frame_step = timedelta(seconds=interval or 1 / 30)
+    batch = {device: [] for device in devices}
+
+    cpu_before = cpu_seconds()
+    started = time.perf_counter()
+    for frame_number in range(frame_count):
+        due = started + frame_number * interval
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        for device in devices:
+            payload = frames[frame_number % len(frames)]
+            metadata = {
+                "frame_id": f"{device}-{frame_number}",
+                "frame_number": frame_number,
+                "timestamp": (start_time + frame_number * frame_step).isoformat(),
+                "encoding": "jpg",
+                "original_shape": [height, width, 3],
+            }
+            topic = f"video/stream/{device}/bench"
+            sent_at[(device, frame_number)] = time.perf_counter()
+            if config["protocol"] == "envelope":
+                publish(f"{topic}/envelope", encode_envelope(metadata, payload))
+            elif config["protocol"] == "batch":
+                batch[device].append(encode_envelope(metadata, payload))
+                if len(batch[device]) == config["batch_size"]:
+                    publish(f"{topic}/batch", encode_batch(batch[device]))
+                    batch[device] = []
+            else:
+                publish(f"{topic}/metadata", json.dumps(metadata).encode())
+                publish(f"{topic}/frame", payload)
+    for device, envelopes in batch.items():
+        if envelopes:
+            publish(f"video/stream/{device}/bench/batch", encode_batch(envelopes))
+
+    expected = frame_count * len(devices)
+    deadline = time.perf_counter() + max(30, config["duration"] * 4)
+    while len(completed) < expected and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    finalize_started = time.perf_counter()
+    for encoder in list(subscriber.encoders.values()):
+        encoder.finalize()
+    finalize_time = time.perf_counter() - finalize_started
+    cpu_used = cpu_seconds() - cpu_before
+
+    subscriber.drain_pipeline()
+    subscriber.store.close()
+    subscriber.assembler.shutdown()
+    bytes_written = folder_size(output_folder)
+    shutil.rmtree(output_folder, ignore_errors=True)
+
+    written = len(completed)
+    return {
+        "frames_sent": expected,
+        "frames_written": written,
+        "elapsed_s": elapsed,
+        "frames_per_second": written / elapsed if elapsed else None,
+        "latency_p50_ms": (percentile(completed, 0.5) or 0) * 1000,
+        "latency_p99_ms": (percentile(completed, 0.99) or 0) * 1000,
+        "cpu_ms_per_frame": cpu_used * 1000 / written if written else None,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "bytes_written": bytes_written,
+        "jpeg_bytes": sum(len(frame) for frame in frames) // len(frames),
+        "finalize_s": finalize_time,
+    }
+
+
+def _run_isolated(config, queue):
+    queue.put(run_config(config))
+
+
+def run_isolated(config):
+    """Run a configuration in a fresh process"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_isolated, args=(config, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print how each metric moved against a previous results file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {}
+    for run in baseline["runs"]:
+        # Results from before engines were selectable ran on threads
+        config = dict({"engine": "threads"}, **run["config"])
+        previous[json.dumps(config, sort_keys=True)] = run["metrics"]
+    for run in results["runs"]:
+        old = previous.get(json.dumps(run["config"], sort_keys=True))
+        if not old:
+            continue
+        changes = []
+        for metric in COMPARED_METRICS:
+            if old.get(metric) and run["metrics"].get(metric) is not None:
+                change = (run["metrics"][metric] - old[metric]) / old[metric] * 100
+                changes.append(f"{metric} {change:+.1f}%")
+        print(f"{describe(run['config'])}: {', '.join(changes)}")
+
+
+def describe(config):
+    width, height = config["resolution"]
+    return (
+        f"{config['devices']} devices @ {config['fps']} fps, {width}x{height}, "
+        f"q{config['quality']}, {config['protocol']}, {config['engine']}"
+    )
+
+
+def parse_list(value, cast=int):
+    return [cast(item) for item in value.split(",") if item]
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--devices", default="1,4", help="comma separated device counts")
+    parser.add_argument("--fps", default="30", help="comma separated fps, 0 = unpaced")
+    parser.add_argument("--resolution", default="640x480", help="comma separated WxH")
+    parser.add_argument("--quality", default="80", help="comma separated JPEG qualities")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per run")
+    parser.add_argument("--frames", type=int, default=300, help="frames per device when unpaced")
+    parser.add_argument("--protocol", choices=("pair", "envelope", "batch"), default="pair")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--transport", choices=("direct", "broker"), default="direct")
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument(
+        "--option",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="subscriber constructor option (JSON value), may repeat",
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    subscriber_options = {}
+    for option in args.option:
+        name, _, value = option.partition("=")
+        try:
+            subscriber_options[name] = json.loads(value)
+        except ValueError:
+            subscriber_options[name] = value
+
+    results = {
+        "revision": git_revision(),
+        "created_at": datetime.now().isoformat(),
+        "cpu_count": os.cpu_count(),
+        "runs": [],
+    }
+    for devices, fps, resolution, quality in itertools.product(
+        parse_list(args.devices),
+        parse_list(args.fps, float),
+        parse_list(args.resolution, parse_resolution),
+        parse_list(args.quality),
+    ):
+        config = {
+            "devices": devices,
+            "fps": fps,
+            "resolution": resolution,
+            "quality": quality,
+            "duration": args.duration,
+            "frames": args.frames,
+            "protocol": args.protocol,
+            "batch_size": args.batch_size,
+            "transport": args.transport,
+            "engine": args.engine,
+            "log_level": args.log_level,
+            "subscriber_options": subscriber_options,
+        }
+        metrics = run_isolated(config)
+        results["runs"].append({"config": config, "metrics": metrics})
+        print(
+            f"{describe(config)}: {metrics['frames_per_second']:.1f} frames/s, "
+            f"p50 {metrics['latency_p50_ms']:.1f} ms, p99 {metrics['latency_p99_ms']:.1f} ms, "
+            f"{metrics['cpu_ms_per_frame']:.2f} CPU ms/frame, "
+            f"{metrics['peak_rss_mb']:.0f} MB peak RSS"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.baseline:
+        compare(results, args.baseline)
+    return results
+
+
+if __name__ == "__main__":
+    main()
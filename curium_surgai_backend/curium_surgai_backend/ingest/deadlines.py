@@ -0,0 +1,77 @@
+import heapq
+import threading
+import time
+
+
+class DeadlineTracker:
+    """Inactivity timeouts for many keys on a min-heap with lazy invalidation.
+
+    The heap holds at most one (deadline, key) entry per key. touch() of a
+    known key only stores the new activity time in the key's entry, without
+    locking or touching the heap; when a stale heap entry comes due,
+    expired() notices the newer activity and pushes a fresh deadline
+    instead of expiring the key.
+
+    A key expired concurrently with a touch() is re-registered by that
+    touch(), so activity is never lost: expired() clears an entry's alive
+    flag before reading its time, and touch() writes the time before
+    reading the flag.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.heap = []
+        # key -> [last activity, alive]
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def touch(self, key, now=None):
+        """Record activity for key; True if this registered it as a new key"""
+        now = now or time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[0] = now
+            if entry[1]:
+                return False
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1]:
+                entry[0] = max(entry[0], now)
+                return False
+            self.entries[key] = [now, True]
+            heapq.heappush(self.heap, (now + self.timeout, key))
+            return True
+
+    def expired(self, now=None):
+        """Remove and return the keys inactive for longer than the timeout"""
+        now = now or time.time()
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, key = heapq.heappop(self.heap)
+                entry = self.entries[key]
+                entry[1] = False
+                deadline = entry[0] + self.timeout
+                if deadline > now:
+                    # Touched since this deadline was scheduled
+                    entry[1] = True
+                    heapq.heappush(self.heap, (deadline, key))
+                else:
+                    del self.entries[key]
+                    expired.append(key)
+        return expired
+
+    def next_deadline(self):
+        """Earliest scheduled deadline (possibly stale, never late), or None"""
+        heap = self.heap
+        return heap[0][0] if heap else None
+
+    def items(self):
+        """(key, last activity) pairs"""
+        return [(key, entry[0]) for key, entry in list(self.entries.items())]
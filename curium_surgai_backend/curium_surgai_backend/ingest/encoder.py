@@ -0,0 +1,179 @@
+import heapq
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from ingest.hls import HLS_FOLDER, HlsWriter
+
+logger = logging.getLogger(__name__)
+
+VIDEO_FPS = 30.0
+
+
+class IncrementalVideoEncoder:
+    """Encode one stream session into an MP4 while its frames arrive.
+
+    Frames are appended by frame_number through a small reorder window:
+    a frame is written as soon as it is the next expected number, or when
+    the window overflows. Frames that arrive after a later number has been
+    written are counted in late_frames and skipped; the caller rebuilds the
+    video from disk to include them.
+
+    A frame given as pixels may come with a release callback, called once
+    the encoder no longer needs them, so their buffer can be reused.
+
+    With hls_time set, the same frames also go to an HlsWriter, for a live
+    HLS playlist next to the video. The playlist outlives finalize(), which
+    only closes the MP4: frames appended after it still reach the playlist,
+    until close() ends the session.
+    """
+
+    def __init__(self, video_path, fps=VIDEO_FPS, reorder_window=8, hls_time=None):
+        self.video_path = video_path
+        self.partial_path = f"{os.path.splitext(video_path)[0]}.partial.mp4"
+        self.fps = fps
+        self.reorder_window = reorder_window
+        self.lock = threading.Lock()
+        self.pending = []
+        self.sequence = 0
+        self.next_frame_number = None
+        self.writer = None
+        self.size = None
+        # Frames not already at the video size are resized into this
+        self.resized = None
+        self.hls_time = hls_time
+        self.hls = None
+        self.frames_written = 0
+        self.late_frames = 0
+        self.last_append = time.time()
+        # Moving average of the seconds between appends; None before the second
+        self.frame_interval = None
+        self.finalized = False
+
+    def append(
+        self, frame_number, frame_data=None, metadata=None, frame=None, release=None
+    ):
+        """Queue a frame, given either as encoded bytes or decoded pixels.
+
+        Returns False, without taking over release, once finalized.
+        """
+        with self.lock:
+            if self.finalized:
+                if self.hls is not None:
+                    # The video is rebuilt from disk; the playlist goes on
+                    self._encode(frame_number, frame_data, metadata, frame)
+                return False
+            now = time.time()
+            if self.sequence or self.late_frames:
+                # Not the first append
+                interval = now - self.last_append
+                self.frame_interval = (
+                    interval
+                    if self.frame_interval is None
+                    else 0.9 * self.frame_interval + 0.1 * interval
+                )
+            self.last_append = now
+            if (
+                self.next_frame_number is not None
+                and frame_number < self.next_frame_number
+            ):
+                self.late_frames += 1
+                if release:
+                    release()
+                return True
+            self.sequence += 1
+            heapq.heappush(
+                self.pending,
+                (frame_number, self.sequence, frame_data, metadata, frame, release),
+            )
+            while self.pending and (
+                len(self.pending) > self.reorder_window
+                or self.pending[0][0] == self.next_frame_number
+            ):
+                self._write(heapq.heappop(self.pending))
+            return True
+
+    def idle_for(self, now=None):
+        return (now or time.time()) - self.last_append
+
+    def finalize(self):
+        """Flush the reorder window and close the container"""
+        with self.lock:
+            if self.finalized:
+                return self.frames_written > 0
+            self.finalized = True
+            while self.pending:
+                self._write(heapq.heappop(self.pending))
+            if self.writer is None:
+                return False
+            self.writer.release()
+            self.writer = None
+            os.replace(self.partial_path, self.video_path)
+            logger.info(
+                "Video created at %s (%d frames)", self.video_path, self.frames_written
+            )
+            return True
+
+    def close(self):
+        """Finalize the video and end the HLS playlist: the session is over"""
+        try:
+            return self.finalize()
+        finally:
+            with self.lock:
+                if self.hls is not None:
+                    self.hls.close()
+                    self.hls = None
+
+    def start_hls(self):
+        folder = os.path.join(os.path.dirname(self.video_path), HLS_FOLDER)
+        try:
+            self.hls = HlsWriter(folder, self.size, self.fps, self.hls_time)
+        except OSError as e:
+            # Still write the MP4
+            logger.warning("Could not start HLS output in %s: %s", folder, e)
+
+    def _write(self, entry):
+        frame_number, _, frame_data, metadata, frame, release = entry
+        try:
+            self._encode(frame_number, frame_data, metadata, frame)
+        finally:
+            if release:
+                release()
+
+    def _encode(self, frame_number, frame_data, metadata, frame):
+        if self.next_frame_number is not None and frame_number < self.next_frame_number:
+            self.late_frames += 1
+            return
+        self.next_frame_number = frame_number + 1
+
+        if frame is None:
+            frame = cv2.imdecode(
+                np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR
+            )
+            if frame is None:
+                logger.debug("Could not decode frame %s for encoding", frame_number)
+                return
+
+        if self.size is None:
+            # The first frame fixes the video size: its original_shape, as
+            # restore_shape would scale it, or else its own size
+            original_shape = (metadata or {}).get("original_shape")
+            height, width = (original_shape or frame.shape)[:2]
+            self.size = (width, height)
+            self.resized = np.empty((height, width, 3), dtype=np.uint8)
+            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+            self.writer = cv2.VideoWriter(self.partial_path, fourcc, self.fps, self.size)
+            if self.hls_time:
+                self.start_hls()
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            # Decode and upscale straight to the video size, reusing one buffer
+            frame = cv2.resize(frame, self.size, dst=self.resized)
+        if self.writer is not None:
+            self.writer.write(frame)
+            self.frames_written += 1
+        if self.hls is not None:
+            self.hls.write(frame)
@@ -0,0 +1,212 @@
+"""Single-message frame envelope: a binary header followed by the image.
+
+Layout (network byte order)::
+
+    magic          4s   b"CSF" + format version
+    header_length  H    number of header bytes that follow
+    frame_number   I    NO_FRAME_NUMBER if the device sent none
+    timestamp      d    POSIX seconds
+    original_shape 3H   height, width, channels, zeros if not known
+    stored_shape   3H   shape of the encoded image, zeros if not compressed
+    encoding       4s   e.g. b"jpg", NUL padded
+    frame_id       B + utf-8 bytes
+    timestamp_text H + utf-8 bytes  the timestamp exactly as the device sent it
+    extra          I + utf-8 JSON   any other metadata, e.g. video_info
+    ... optional fields added by later versions ...
+    image bytes    everything after the header
+
+Readers skip any header bytes they do not understand, so fields can be
+appended without breaking older subscribers. Envelopes of publishers that
+predate timestamp_text and extra end after frame_id; their timestamp is
+rebuilt from the POSIX seconds, in UTC.
+
+Several envelopes can be sent in one batch message::
+
+    magic          4s   b"CSB" + format version
+    count          H    number of envelopes
+    count times:
+        length     I    size of the envelope
+        envelope        as above
+"""
+
+import json
+import struct
+import time
+from datetime import datetime, timezone
+
+MAGIC = b"CSF\x01"
+PREFIX = struct.Struct("!4sH")
+FIELDS = struct.Struct("!Id3H3H4sB")
+TIMESTAMP_TEXT = struct.Struct("!H")
+EXTRA = struct.Struct("!I")
+
+# frame_number of a frame sent without one; the subscriber numbers it by
+# arrival, as it does frames sent as a metadata and frame pair
+NO_FRAME_NUMBER = 0xFFFFFFFF
+
+# Metadata carried by the fixed fields; everything else travels as extra
+ENVELOPE_KEYS = (
+    "frame_id",
+    "frame_number",
+    "timestamp",
+    "original_shape",
+    "compressed_shape",
+    "encoding",
+)
+
+BATCH_MAGIC = b"CSB\x01"
+BATCH_PREFIX = struct.Struct("!4sH")
+BATCH_ENTRY = struct.Struct("!I")
+
+
+class EnvelopeError(ValueError):
+    pass
+
+
+def encode_envelope(metadata, image_bytes):
+    """Pack frame metadata and its encoded image into one payload"""
+    frame_id = str(metadata["frame_id"]).encode("utf-8")
+    timestamp_text = metadata["timestamp"].encode("utf-8")
+    timestamp = datetime.fromisoformat(metadata["timestamp"])
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    extra = {key: value for key, value in metadata.items() if key not in ENVELOPE_KEYS}
+    extra = json.dumps(extra, separators=(",", ":")).encode("utf-8") if extra else b""
+    original_shape = tuple(metadata.get("original_shape") or (0, 0, 0))
+    stored_shape = tuple(metadata.get("compressed_shape") or (0, 0, 0))
+    header = FIELDS.pack(
+        metadata.get("frame_number", NO_FRAME_NUMBER),
+        timestamp.timestamp(),
+        *(original_shape + (3,))[:3],
+        *(stored_shape + (3,))[:3],
+        metadata.get("encoding", "jpg").encode("ascii"),
+        len(frame_id),
+    ) + frame_id
+    header += TIMESTAMP_TEXT.pack(len(timestamp_text)) + timestamp_text
+    header += EXTRA.pack(len(extra)) + extra
+    return PREFIX.pack(MAGIC, len(header)) + header + bytes(image_bytes)
+
+
+def decode_envelope(payload):
+    """Split an envelope into a metadata dict and a zero-copy view of the image"""
+    view = memoryview(payload)
+    if len(view) < PREFIX.size + FIELDS.size:
+        raise EnvelopeError("Envelope too short")
+    magic, header_length = PREFIX.unpack_from(view)
+    if magic[:3] != MAGIC[:3]:
+        raise EnvelopeError("Not a frame envelope")
+    (
+        frame_number,
+        timestamp,
+        original_h,
+        original_w,
+        original_c,
+        stored_h,
+        stored_w,
+        stored_c,
+        encoding,
+        frame_id_length,
+    ) = FIELDS.unpack_from(view, PREFIX.size)
+    frame_id_start = PREFIX.size + FIELDS.size
+    image_start = PREFIX.size + header_length
+    if frame_id_start + frame_id_length > image_start or image_start > len(view):
+        raise EnvelopeError("Malformed envelope header")
+
+    frame_id = bytes(view[frame_id_start : frame_id_start + frame_id_length])
+    metadata = {
+        "frame_id": frame_id.decode("utf-8"),
+        "timestamp": datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+        "encoding": encoding.rstrip(b"\0").decode("ascii"),
+    }
+    if frame_number != NO_FRAME_NUMBER:
+        metadata["frame_number"] = frame_number
+    if original_h and original_w:
+        metadata["original_shape"] = [original_h, original_w, original_c]
+    if stored_h and stored_w:
+        metadata["compressed_shape"] = [stored_h, stored_w, stored_c]
+
+    offset = frame_id_start + frame_id_length
+    if offset + TIMESTAMP_TEXT.size <= image_start:
+        (length,) = TIMESTAMP_TEXT.unpack_from(view, offset)
+        offset += TIMESTAMP_TEXT.size
+        if offset + length > image_start:
+            raise EnvelopeError("Malformed envelope header")
+        metadata["timestamp"] = bytes(view[offset : offset + length]).decode("utf-8")
+        offset += length
+    if offset + EXTRA.size <= image_start:
+        (length,) = EXTRA.unpack_from(view, offset)
+        offset += EXTRA.size
+        if offset + length > image_start:
+            raise EnvelopeError("Malformed envelope header")
+        if length:
+            extra = json.loads(bytes(view[offset : offset + length]))
+            # The fixed fields win over anything extra repeats
+            metadata = dict(extra, **metadata)
+    return metadata, view[image_start:]
+
+
+def encode_batch(envelopes):
+    """Pack encoded envelopes into one batch payload"""
+    parts = [BATCH_PREFIX.pack(BATCH_MAGIC, len(envelopes))]
+    for envelope in envelopes:
+        parts.append(BATCH_ENTRY.pack(len(envelope)))
+        parts.append(bytes(envelope))
+    return b"".join(parts)
+
+
+def iter_batch(payload):
+    """Yield zero-copy views of the envelopes in a batch payload"""
+    view = memoryview(payload)
+    if len(view) < BATCH_PREFIX.size:
+        raise EnvelopeError("Batch too short")
+    magic, count = BATCH_PREFIX.unpack_from(view)
+    if magic[:3] != BATCH_MAGIC[:3]:
+        raise EnvelopeError("Not a frame batch")
+    offset = BATCH_PREFIX.size
+    for _ in range(count):
+        if offset + BATCH_ENTRY.size > len(view):
+            raise EnvelopeError("Truncated batch")
+        (length,) = BATCH_ENTRY.unpack_from(view, offset)
+        offset += BATCH_ENTRY.size
+        if offset + length > len(view):
+            raise EnvelopeError("Truncated batch")
+        yield view[offset : offset + length]
+        offset += length
+
+
+class FrameBatcher:
+    """Publisher-side helper that groups envelopes into batch messages.
+
+    A batch is flushed through publish(payload) once it holds max_frames
+    envelopes or its oldest envelope has waited max_latency seconds,
+    whichever comes first. Call poll() periodically so a quiet stream
+    still meets its latency budget.
+    """
+
+    def __init__(self, publish, max_frames=10, max_latency=0.2):
+        self.publish = publish
+        self.max_frames = max_frames
+        self.max_latency = max_latency
+        self.envelopes = []
+        self.first_added = None
+
+    def add(self, metadata, image_bytes):
+        if not self.envelopes:
+            self.first_added = time.monotonic()
+        self.envelopes.append(encode_envelope(metadata, image_bytes))
+        if len(self.envelopes) >= self.max_frames:
+            self.flush()
+        else:
+            self.poll()
+
+    def poll(self):
+        if (
+            self.envelopes
+            and time.monotonic() - self.first_added >= self.max_latency
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.envelopes:
+            envelopes, self.envelopes = self.envelopes, []
+            self.publish(encode_batch(envelopes))
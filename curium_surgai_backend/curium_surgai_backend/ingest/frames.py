@@ -0,0 +1,47 @@
+import json
+import os
+import re
+
+import cv2
+import numpy as np
+
+FRAME_FILE_PATTERN = re.compile(r"_frame(\d+)\.jpg$")
+
+
+def restore_shape(frame, metadata):
+    """Scale a decoded frame back up to the original_shape in its metadata"""
+    original_shape = (metadata or {}).get("original_shape")
+    if (
+        frame is not None
+        and original_shape
+        and tuple(frame.shape[:2]) != tuple(original_shape[:2])
+    ):
+        frame = cv2.resize(frame, (original_shape[1], original_shape[0]))
+    return frame
+
+
+def decode_frame(frame_data, metadata):
+    """Decode an encoded frame payload at its original shape"""
+    frame = cv2.imdecode(np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return restore_shape(frame, metadata)
+
+
+def load_frame(filepath, metadata=None):
+    """Read a stored frame at its original shape"""
+    if metadata is None:
+        metadata_filepath = f"{os.path.splitext(filepath)[0]}_metadata.json"
+        if os.path.exists(metadata_filepath):
+            with open(metadata_filepath) as f:
+                metadata = json.load(f)
+    return restore_shape(cv2.imread(filepath), metadata)
+
+
+def sorted_frame_files(folder_path):
+    """List the frame images in a folder ordered by frame number"""
+    frame_files = []
+    for filename in os.listdir(folder_path):
+        match = FRAME_FILE_PATTERN.search(filename)
+        if match:
+            frame_files.append((int(match.group(1)), filename))
+    frame_files.sort()
+    return [filename for _, filename in frame_files]
@@ -0,0 +1,189 @@
+"""Live HLS output of a session, written while its frames arrive.
+
+HlsWriter pipes the frames the live encoder writes, as raw BGR pixels, to
+an ffmpeg process that encodes H.264 and cuts it into segments of about
+hls_time seconds under the session folder:
+
+    {device_id}/{timestamp}/hls/index.m3u8
+    {device_id}/{timestamp}/hls/segment_00000.ts ...
+
+The playlist is an EVENT playlist: segments are only ever appended, so a
+player opening it mid-session plays from the start and follows the live
+edge, and closing the writer adds #EXT-X-ENDLIST, turning it into a
+complete recording. Segments are written to a temporary name and renamed
+when complete, so a player reading the folder never sees a partial one.
+
+ffmpeg is fed from a thread of the writer's own, through a short queue:
+a write worker never waits on ffmpeg, and frames ffmpeg is too slow for
+are dropped from the playlist, never from the MP4. Closing is queued the
+same way, so the writer's thread, not the caller, waits for ffmpeg to
+finish the playlist.
+
+ffmpeg is an external dependency: without it on the PATH the extractor
+logs a warning and only writes the MP4.
+"""
+
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HLS_FOLDER = "hls"
+PLAYLIST_FILENAME = "index.m3u8"
+# ffmpeg's errors, if any; a file so a chatty ffmpeg can never fill a pipe
+LOG_FILENAME = "ffmpeg.log"
+
+# Seconds per segment, the default of the EXTRACTOR_HLS_TIME setting
+HLS_TIME = 2.0
+
+# Seconds ffmpeg gets to encode the frames it still holds once closed
+CLOSE_TIMEOUT = 30.0
+
+# Frames waiting for ffmpeg, per session; more are dropped
+QUEUE_FRAMES = 8
+
+# Seconds the feeding thread waits for a frame before checking for close()
+POLL_INTERVAL = 0.5
+
+
+def find_ffmpeg():
+    return shutil.which("ffmpeg")
+
+
+class HlsWriter:
+    """An ffmpeg process turning a session's frames into an HLS playlist"""
+
+    def __init__(self, folder, size, fps, hls_time=HLS_TIME, ffmpeg=None):
+        self.folder = folder
+        self.playlist_path = os.path.join(folder, PLAYLIST_FILENAME)
+        self.log_path = os.path.join(folder, LOG_FILENAME)
+        os.makedirs(folder, exist_ok=True)
+        width, height = size
+        # One keyframe per segment, so segments are cut at hls_time
+        keyframe_interval = str(max(1, round(fps * hls_time)))
+        command = [
+            ffmpeg or find_ffmpeg() or "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "bgr24",
+            "-s",
+            f"{width}x{height}",
+            "-framerate",
+            str(fps),
+            "-i",
+            "pipe:0",
+            # yuv420p, which players expect, needs even dimensions
+            "-vf",
+            "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-pix_fmt",
+            "yuv420p",
+            "-g",
+            keyframe_interval,
+            "-keyint_min",
+            keyframe_interval,
+            "-sc_threshold",
+            "0",
+            "-f",
+            "hls",
+            "-hls_time",
+            str(hls_time),
+            "-hls_list_size",
+            "0",
+            "-hls_playlist_type",
+            "event",
+            "-hls_flags",
+            "independent_segments+temp_file",
+            "-hls_segment_filename",
+            os.path.join(folder, "segment_%05d.ts"),
+            self.playlist_path,
+        ]
+        with open(self.log_path, "wb") as log:
+            self.process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log
+            )
+        self.failed = False
+        self.dropped = 0
+        self.frames = queue.Queue(QUEUE_FRAMES)
+        self.closing = threading.Event()
+        # Not a daemon: the playlist is ended even while the process exits
+        self.thread = threading.Thread(target=self._run, name="hls")
+        self.thread.start()
+
+    def write(self, frame):
+        """Queue a copy of one frame, or drop it while ffmpeg is behind"""
+        if self.failed:
+            return
+        try:
+            self.frames.put_nowait(np.ascontiguousarray(frame).tobytes())
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """End the playlist once the queued frames are encoded; returns at once"""
+        self.closing.set()
+        try:
+            self.frames.put_nowait(None)
+        except queue.Full:
+            # The thread notices closing once it has drained the queue
+            pass
+
+    def _run(self):
+        while True:
+            try:
+                frame = self.frames.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self.closing.is_set():
+                    break
+                continue
+            if frame is None:
+                break
+            if self.failed:
+                continue
+            try:
+                self.process.stdin.write(frame)
+            except OSError as e:
+                # ffmpeg exited; the MP4 is still written
+                self.failed = True
+                logger.warning("HLS output to %s stopped: %s", self.folder, e)
+        self._finish()
+
+    def _finish(self):
+        """Let ffmpeg write the last segment and end the playlist"""
+        if self.dropped:
+            logger.warning(
+                "ffmpeg fell behind on %s, %d frames left out of the playlist",
+                self.playlist_path,
+                self.dropped,
+            )
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=CLOSE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        if self.process.returncode:
+            logger.warning(
+                "ffmpeg exited with %s writing %s, see %s",
+                self.process.returncode,
+                self.playlist_path,
+                self.log_path,
+            )
+        elif not os.path.getsize(self.log_path):
+            os.remove(self.log_path)
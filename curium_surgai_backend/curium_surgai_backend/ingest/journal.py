@@ -0,0 +1,171 @@
+"""Append-only journal of stream sessions, for crash recovery.
+
+The extractor appends one JSON line per session event to a journal file in
+its output folder:
+
+    {"event": "started", "device_id": ..., "timestamp": ..., "at": ...}
+    {"event": "progress", ..., "last_frame": 41, "frames": 42, "last_seen": ...}
+    {"event": "finalized", ..., "video_pending": true}
+    {"event": "video_built", ...}
+
+A session is forgotten once nothing is left to do for it: finalized with
+no video pending, or its video built. After a restart the journal says
+which sessions were still open and when they were last seen, without
+walking the received_frames tree. The journal is compacted to one
+"session" line per open session on startup and whenever it has grown by
+COMPACT_AFTER lines, and a line torn by a crash is skipped.
+"""
+
+import json
+import os
+import threading
+import time
+
+JOURNAL_FILENAME = "sessions.journal"
+
+# Lines appended before the journal is rewritten with just the open sessions
+COMPACT_AFTER = 10000
+
+
+def journal_filename(worker_index=0, worker_count=1):
+    if worker_count > 1:
+        return f"sessions-{worker_index}.journal"
+    return JOURNAL_FILENAME
+
+
+def _apply(sessions, entry):
+    """Fold one journal entry into the open sessions"""
+    stream_key = (entry["device_id"], entry["timestamp"])
+    event = entry["event"]
+    if event == "session":
+        sessions[stream_key] = {
+            name: value for name, value in entry.items() if name != "event"
+        }
+        return
+    if event == "video_built" or (
+        event == "finalized" and not entry.get("video_pending")
+    ):
+        sessions.pop(stream_key, None)
+        return
+
+    state = sessions.get(stream_key)
+    if state is None:
+        state = sessions[stream_key] = {
+            "device_id": entry["device_id"],
+            "timestamp": entry["timestamp"],
+            "started_at": entry["at"],
+            "last_seen": entry["at"],
+            "last_frame": None,
+            "frames": 0,
+            "finalized": False,
+        }
+    if event == "started":
+        # Frames arrived again after the session was finalized
+        state["finalized"] = False
+        state["last_seen"] = entry["at"]
+    elif event == "progress":
+        state["last_frame"] = entry["last_frame"]
+        state["frames"] = entry["frames"]
+        state["last_seen"] = entry["last_seen"]
+    elif event == "finalized":
+        state["finalized"] = True
+
+
+class SessionJournal:
+    """The journal file plus the open sessions it describes"""
+
+    def __init__(self, folder, filename=JOURNAL_FILENAME):
+        self.path = os.path.join(folder, filename)
+        self.lock = threading.Lock()
+        self.sessions = self.load()
+        self.appended = 0
+        self.file = open(self.path, "a")
+
+    def load(self):
+        sessions = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        _apply(sessions, json.loads(line))
+                    except (ValueError, KeyError):
+                        # Torn by a crash mid-write
+                        continue
+        except FileNotFoundError:
+            pass
+        return sessions
+
+    def pending(self):
+        """States of the sessions still open, oldest first"""
+        with self.lock:
+            return sorted(self.sessions.values(), key=lambda state: state["last_seen"])
+
+    def frames(self, stream_key):
+        """Frame count last journaled for a session"""
+        state = self.sessions.get(stream_key)
+        return state["frames"] if state else None
+
+    def started(self, stream_key):
+        self._append([self._entry("started", stream_key)])
+
+    def progress(self, updates):
+        """Journal (stream_key, last_frame, frames, last_seen) updates at once"""
+        self._append(
+            [
+                self._entry(
+                    "progress",
+                    stream_key,
+                    last_frame=last_frame,
+                    frames=frames,
+                    last_seen=last_seen,
+                )
+                for stream_key, last_frame, frames, last_seen in updates
+            ]
+        )
+
+    def finalized(self, stream_key, video_pending=False):
+        self._append(
+            [self._entry("finalized", stream_key, video_pending=video_pending)]
+        )
+
+    def video_built(self, stream_key):
+        self._append([self._entry("video_built", stream_key)])
+
+    def compact(self):
+        """Rewrite the journal with one line per open session"""
+        with self.lock:
+            partial_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(partial_path, "w") as f:
+                for state in self.sessions.values():
+                    f.write(json.dumps(dict(state, event="session")) + "\n")
+            self.file.close()
+            os.replace(partial_path, self.path)
+            self.file = open(self.path, "a")
+            self.appended = 0
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def _entry(self, event, stream_key, **fields):
+        device_id, timestamp = stream_key
+        return dict(
+            event=event,
+            device_id=device_id,
+            timestamp=timestamp,
+            at=time.time(),
+            **fields,
+        )
+
+    def _append(self, entries):
+        if not entries:
+            return
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with self.lock:
+            if self.file.closed:
+                return
+            for entry in entries:
+                _apply(self.sessions, entry)
+            self.file.write(lines)
+            self.file.flush()
+            self.appended += len(entries)
@@ -0,0 +1,158 @@
+"""In-process stand-in for an MQTT broker.
+
+LocalBroker routes publishes to LocalClient instances, which expose the
+subset of the paho client API MultiDeviceVideoSubscriber uses. Shared
+subscriptions ($share/<group>/<filter>) deliver each message to one
+member of the group, either round robin (mosquitto's behaviour, and the
+worst case for device affinity) or by a hash of the topic.
+"""
+
+import itertools
+import threading
+import zlib
+
+from paho.mqtt.client import topic_matches_sub
+
+
+class LocalMessage:
+    def __init__(self, topic, payload, qos=0, retain=False, dup=False):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.dup = dup
+
+
+class LocalBroker:
+    def __init__(self, share_strategy="round_robin"):
+        if share_strategy not in ("round_robin", "hash_topic"):
+            raise ValueError(f"Unknown share strategy: {share_strategy}")
+        self.share_strategy = share_strategy
+        self.lock = threading.Lock()
+        # filter -> clients
+        self.subscriptions = {}
+        # (group, filter) -> clients
+        self.shared = {}
+        self.round_robin = {}
+        self.published = 0
+        self.delivered = 0
+
+    def client(self, client_id=None):
+        return LocalClient(self, client_id)
+
+    def subscribe(self, client, topic):
+        with self.lock:
+            if topic.startswith("$share/"):
+                _, group, topic_filter = topic.split("/", 2)
+                members = self.shared.setdefault((group, topic_filter), [])
+                if client not in members:
+                    members.append(client)
+                    self.round_robin[(group, topic_filter)] = itertools.cycle(
+                        list(members)
+                    )
+            else:
+                subscribers = self.subscriptions.setdefault(topic, [])
+                if client not in subscribers:
+                    subscribers.append(client)
+
+    def unsubscribe(self, client, topic):
+        with self.lock:
+            if topic.startswith("$share/"):
+                _, group, topic_filter = topic.split("/", 2)
+                members = self.shared.get((group, topic_filter), [])
+                if client in members:
+                    members.remove(client)
+                    self.round_robin[(group, topic_filter)] = itertools.cycle(
+                        list(members)
+                    )
+            else:
+                subscribers = self.subscriptions.get(topic, [])
+                if client in subscribers:
+                    subscribers.remove(client)
+
+    def disconnect(self, client):
+        with self.lock:
+            for subscribers in self.subscriptions.values():
+                if client in subscribers:
+                    subscribers.remove(client)
+            for key, members in self.shared.items():
+                if client in members:
+                    members.remove(client)
+                    self.round_robin[key] = itertools.cycle(list(members))
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        targets = []
+        with self.lock:
+            self.published += 1
+            for topic_filter, subscribers in self.subscriptions.items():
+                if topic_matches_sub(topic_filter, topic):
+                    targets.extend(subscribers)
+            for (group, topic_filter), members in self.shared.items():
+                if members and topic_matches_sub(topic_filter, topic):
+                    if self.share_strategy == "hash_topic":
+                        index = zlib.crc32(topic.encode()) % len(members)
+                        targets.append(members[index])
+                    else:
+                        targets.append(next(self.round_robin[(group, topic_filter)]))
+        # A client receives each message once, however many filters match
+        for client in dict.fromkeys(targets):
+            self.delivered += 1
+            client.deliver(LocalMessage(topic, payload, qos, retain))
+
+
+class LocalClient:
+    """Minimal paho-compatible client bound to a LocalBroker"""
+
+    def __init__(self, broker, client_id=None):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_connect = None
+        self.on_message = None
+        self.userdata = None
+        self.connected = threading.Event()
+        self.stopped = threading.Event()
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def tls_set(self, *args, **kwargs):
+        pass
+
+    def tls_insecure_set(self, value):
+        pass
+
+    def connect(self, host=None, port=None, keepalive=60):
+        self.stopped.clear()
+        self.connected.set()
+        if self.on_connect:
+            self.on_connect(self, self.userdata, {}, 0)
+        return 0
+
+    def subscribe(self, topic, qos=0):
+        self.broker.subscribe(self, topic)
+        return (0, None)
+
+    def unsubscribe(self, topic):
+        self.broker.unsubscribe(self, topic)
+        return (0, None)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload, qos, retain)
+
+    def deliver(self, msg):
+        if self.connected.is_set() and self.on_message:
+            self.on_message(self, self.userdata, msg)
+
+    def loop_forever(self):
+        self.stopped.wait()
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        self.stopped.set()
+
+    def disconnect(self):
+        self.connected.clear()
+        self.broker.disconnect(self)
+        self.stopped.set()
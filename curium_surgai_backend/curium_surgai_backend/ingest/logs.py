@@ -0,0 +1,106 @@
+"""Logging for the ingest path.
+
+Nothing on the per-message path formats a log line unless its level is
+enabled: calls pass %-style arguments, never f-strings. Errors that can
+repeat for every frame of a session go through ErrorLog, which logs the
+first one per device and stage and then at most one per interval, with
+a count of what it held back. Steady-state activity is reported by one
+SummaryLog line per interval instead of per-frame lines.
+
+Both attach their fields as record attributes (device_id, stage,
+suppressed; frames, bytes, drops, errors, sessions), so a structured
+formatter can emit them without parsing the message.
+"""
+
+import threading
+import time
+
+# Seconds between repeats of one device's errors in the same stage
+ERROR_INTERVAL = 60.0
+
+# Seconds between summary lines
+SUMMARY_INTERVAL = 60.0
+
+
+class ErrorLog:
+    """Warnings rate-limited per (device, stage)"""
+
+    def __init__(self, logger, interval=ERROR_INTERVAL):
+        self.logger = logger
+        self.interval = interval
+        self.lock = threading.Lock()
+        # (device_id, stage) -> [monotonic time last logged, suppressed since]
+        self.recent = {}
+
+    def log(self, device_id, stage, message, *args):
+        now = time.monotonic()
+        key = (device_id, stage)
+        with self.lock:
+            entry = self.recent.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                return
+            suppressed = entry[1] if entry else 0
+            self.recent[key] = [now, 0]
+        if suppressed:
+            message += " (%d more since the last report)"
+            args += (suppressed,)
+        self.logger.warning(message, *args, extra=_fields(device_id, stage, suppressed))
+
+    def flush(self, now=None):
+        """Report what quiet keys held back, and forget them"""
+        now = now or time.monotonic()
+        held = []
+        with self.lock:
+            for key, (logged, suppressed) in list(self.recent.items()):
+                if now - logged >= self.interval:
+                    del self.recent[key]
+                    if suppressed:
+                        held.append((key, suppressed))
+        for (device_id, stage), suppressed in held:
+            self.logger.warning(
+                "%d more %s errors for device %s",
+                suppressed,
+                stage,
+                device_id,
+                extra=_fields(device_id, stage, suppressed),
+            )
+
+
+def _fields(device_id, stage, suppressed):
+    return {"device_id": device_id, "stage": stage, "suppressed": suppressed}
+
+
+class SummaryLog:
+    """One INFO line per interval with what the counters did since the last"""
+
+    def __init__(self, logger, interval=SUMMARY_INTERVAL):
+        self.logger = logger
+        self.interval = interval
+        self.last = time.monotonic()
+        self.previous = {}
+
+    def tick(self, metrics, sessions, now=None):
+        now = now or time.monotonic()
+        elapsed = now - self.last
+        if elapsed < self.interval:
+            return
+        self.last = now
+        with metrics.lock:
+            totals = dict(metrics.counters, errors=sum(metrics.errors.values()))
+        delta = {
+            name: value - self.previous.get(name, 0) for name, value in totals.items()
+        }
+        self.previous = totals
+        self.logger.info(
+            "%d sessions, %d frames (%.1f/s), %.1f MB, %d dropped, %d errors "
+            "in the last %.0fs",
+            sessions,
+            delta["frames"],
+            delta["frames"] / elapsed,
+            delta["bytes"] / 1e6,
+            delta["drops"],
+            delta["errors"],
+            elapsed,
+            extra=dict(delta, sessions=sessions),
+        )
@@ -0,0 +1,251 @@
+"""Pipeline stage timings and counters, exported in Prometheus text format.
+
+Every session's DeviceStreamTracker owns a PipelineMetrics whose parent
+is the subscriber's process-wide PipelineMetrics, so each observation
+lands in both. Histograms use fixed buckets and a per-histogram lock; an
+observation is a bisect and a few integer increments, cheap enough to
+leave on in production.
+
+The scrape endpoint exports the process-wide histograms and the counters
+of each live session; per-session stage percentiles are in the tracker
+status report.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = (
+    "receive",
+    "parse",
+    "pairing_wait",
+    "decode",
+    "resize",
+    "reencode",
+    "write_image",
+    "write_metadata",
+    "encode",
+    "video_build",
+)
+
+COUNTERS = ("frames", "bytes", "drops", "late_frames")
+
+# Per-session counters exported by the scrape endpoint; the pairing ones are
+# kept by the device's FramePairingBuffer
+DEVICE_COUNTERS = COUNTERS + ("orphaned", "evicted", "duplicates", "budget_evicted")
+
+# Seconds; the top buckets are for video builds
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count", "lock")
+
+    def __init__(self):
+        # One slot per bucket plus the +Inf overflow
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(LATENCY_BUCKETS, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile"""
+        counts, _, count = self.snapshot()
+        if not count:
+            return None
+        rank = fraction * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                break
+        return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else None
+
+
+class PipelineMetrics:
+    """Stage histograms and counters for one device, or for the whole process"""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.errors = dict.fromkeys(STAGES, 0)
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        self.stages[stage].observe(seconds)
+        if self.parent:
+            self.parent.observe(stage, seconds)
+
+    def since(self, stage, started):
+        """Observe the time elapsed since a time.perf_counter() reading"""
+        self.observe(stage, time.perf_counter() - started)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+        if self.parent:
+            self.parent.count(name, value)
+
+    def error(self, stage):
+        with self.lock:
+            self.errors[stage] += 1
+        if self.parent:
+            self.parent.error(stage)
+
+    def summary(self):
+        """Per-stage count and approximate p50/p99 in milliseconds"""
+        stages = {}
+        for stage, histogram in self.stages.items():
+            if not histogram.count:
+                continue
+            p50, p99 = histogram.quantile(0.5), histogram.quantile(0.99)
+            stages[stage] = {
+                "count": histogram.count,
+                "p50_ms": p50 * 1000 if p50 is not None else None,
+                "p99_ms": p99 * 1000 if p99 is not None else None,
+            }
+        with self.lock:
+            return {
+                "stages": stages,
+                "counters": dict(self.counters),
+                "errors": {stage: n for stage, n in self.errors.items() if n},
+            }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render(metrics, trackers=(), prefix="extractor", budget=None, registry=None):
+    """Prometheus text exposition of process metrics and per-session counters"""
+    lines = [
+        f"# HELP {prefix}_stage_seconds Time spent in each pipeline stage",
+        f"# TYPE {prefix}_stage_seconds histogram",
+    ]
+    for stage, histogram in metrics.stages.items():
+        counts, total, count = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append(
+                f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} '
+                f"{cumulative}"
+            )
+        lines.append(
+            f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}'
+        )
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {count}')
+
+    with metrics.lock:
+        counters = dict(metrics.counters)
+        errors = dict(metrics.errors)
+    lines.append(f"# TYPE {prefix}_errors_total counter")
+    for stage, value in errors.items():
+        lines.append(f'{prefix}_errors_total{{stage="{stage}"}} {value}')
+    for name, value in counters.items():
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+
+    if budget is not None:
+        lines.append(f"# TYPE {prefix}_pending_bytes gauge")
+        lines.append(f"{prefix}_pending_bytes {budget.used}")
+        lines.append(f"# TYPE {prefix}_pending_budget_bytes gauge")
+        lines.append(f"{prefix}_pending_budget_bytes {budget.max_bytes}")
+        lines.append(f"# TYPE {prefix}_budget_evicted_total counter")
+        lines.append(f"{prefix}_budget_evicted_total {budget.evicted}")
+
+    if registry is not None:
+        lines.append(f"# TYPE {prefix}_unregistered_messages_total counter")
+        lines.append(f"{prefix}_unregistered_messages_total {registry.rejected}")
+
+    device_samples = {name: [] for name in DEVICE_COUNTERS + ("queue_depth",)}
+    for tracker in trackers:
+        labels = (
+            f'device="{_escape(tracker.device_id)}",'
+            f'session="{_escape(tracker.timestamp)}"'
+        )
+        with tracker.metrics.lock:
+            values = dict(tracker.metrics.counters)
+        values.update(
+            orphaned=tracker.pairing.orphaned,
+            evicted=tracker.pairing.evicted,
+            duplicates=tracker.pairing.duplicates,
+            budget_evicted=tracker.pairing.budget_evicted,
+            queue_depth=tracker.queue_depth,
+        )
+        for name, samples in device_samples.items():
+            samples.append((labels, values[name]))
+    for name, samples in device_samples.items():
+        metric = f"{prefix}_device_{name}"
+        if name == "queue_depth":
+            lines.append(f"# TYPE {metric} gauge")
+        else:
+            metric += "_total"
+            lines.append(f"# TYPE {metric} counter")
+        lines.extend(f"{metric}{{{labels}}} {value}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(subscriber, port, address=""):
+    """Serve GET /metrics for a subscriber from a daemon thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render(
+                subscriber.metrics,
+                list(subscriber.device_trackers.values()),
+                budget=subscriber.pending_budget,
+                registry=subscriber.device_registry,
+            ).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
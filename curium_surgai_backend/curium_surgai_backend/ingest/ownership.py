@@ -0,0 +1,42 @@
+import os
+import zlib
+
+LEASE_FILENAME = ".owner"
+
+
+def owner_of(device_id, worker_count):
+    """Index of the worker a device is pinned to (stable across processes)"""
+    return zlib.crc32(device_id.encode("utf-8")) % worker_count
+
+
+class SessionLease:
+    """Lease file recording which worker owns a session folder.
+
+    The file holds the owner's worker id. A worker that starts receiving a
+    session owned by someone else takes the lease over; the previous owner
+    notices when its own stream times out and leaves finalization to the
+    new owner.
+    """
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+
+    def holder(self, folder):
+        try:
+            with open(os.path.join(folder, LEASE_FILENAME)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def claim(self, folder):
+        """Take ownership of a session, returning the previous foreign owner"""
+        previous = self.holder(folder)
+        if previous != self.worker_id:
+            path = os.path.join(folder, LEASE_FILENAME)
+            with open(f"{path}.tmp", "w") as f:
+                f.write(self.worker_id)
+            os.replace(f"{path}.tmp", path)
+        return previous if previous != self.worker_id else None
+
+    def owns(self, folder):
+        return self.holder(folder) == self.worker_id
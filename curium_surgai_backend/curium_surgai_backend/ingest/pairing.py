@@ -0,0 +1,268 @@
+import logging
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+class PendingBudget:
+    """Byte budget shared by the unpaired frames of every pairing buffer.
+
+    When the frames waiting for their metadata across all streams exceed
+    max_bytes, the oldest of them, whichever stream it belongs to, is
+    evicted until the total fits again.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.evicted = 0
+        self.buffers = weakref.WeakSet()
+        # usage_lock is taken inside buffer locks; reclaim_lock is held
+        # while taking them, never the other way round
+        self.usage_lock = threading.Lock()
+        self.reclaim_lock = threading.Lock()
+
+    def charge(self, nbytes):
+        with self.usage_lock:
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self.usage_lock:
+            self.used -= nbytes
+
+    def exceeded(self):
+        return self.used > self.max_bytes
+
+    def reclaim(self):
+        """Evict the globally oldest pending frames until usage fits"""
+        evicted = 0
+        with self.reclaim_lock:
+            while self.exceeded():
+                candidates = [
+                    (buffer.oldest_frame(), id(buffer), buffer)
+                    for buffer in list(self.buffers)
+                ]
+                candidates = [entry for entry in candidates if entry[0] is not None]
+                if not candidates:
+                    break
+                _, _, buffer = min(candidates)
+                if buffer.evict_oldest_frame():
+                    evicted += 1
+            self.evicted += evicted
+        if evicted:
+            logger.debug(
+                "Pending frame budget exceeded: evicted %d frames, "
+                "%d of %d bytes in use",
+                evicted,
+                self.used,
+                self.max_bytes,
+            )
+        return evicted
+
+
+class FramePairingBuffer:
+    """Pair a stream's metadata and frame messages by frame_id.
+
+    Metadata always carries a frame_id. Frames carry one when the device
+    publishes to .../frame/{frame_id}; legacy frames without an id are
+    paired with the oldest unpaired metadata, i.e. in arrival order.
+
+    Unpaired entries expire after ttl seconds (orphaned) and the buffer
+    never holds more than max_pending of them (the oldest is evicted).
+    Unpaired frame payloads also count against an optional PendingBudget
+    shared with other streams (budget_evicted).
+    Redelivered messages are recognised and dropped (duplicates): by
+    frame_id, or for legacy frames flagged as MQTT redeliveries, by the
+    checksum of their payload.
+    """
+
+    def __init__(self, max_pending=64, ttl=5.0, dedup_window=512, budget=None):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # frame_id -> (arrival time, metadata)
+        self.metadata = OrderedDict()
+        # frame_id -> (arrival time, payload)
+        self.frames = OrderedDict()
+        # (arrival time, payload) of frames published without an id
+        self.anonymous_frames = deque()
+        # Recently paired frame_ids and legacy frame checksums
+        self.completed = OrderedDict()
+        self.recent_checksums = deque(maxlen=dedup_window)
+        self.dedup_window = dedup_window
+        self.orphaned = 0
+        self.evicted = 0
+        self.duplicates = 0
+        self.budget_evicted = 0
+        # Bytes of unpaired frame payloads held
+        self.pending_bytes = 0
+        self.budget = budget
+        if budget is not None:
+            budget.buffers.add(self)
+
+    def __len__(self):
+        return len(self.metadata) + len(self.frames) + len(self.anonymous_frames)
+
+    def add_metadata(self, metadata, now=None):
+        """Store metadata, returning (payload, metadata, waited) once paired.
+
+        waited is how long the first half of the pair sat in the buffer.
+        """
+        now = now or time.time()
+        # Topic segments are strings, JSON ids may not be
+        frame_id = str(metadata["frame_id"])
+        with self.lock:
+            self._expire(now)
+            if frame_id in self.completed or frame_id in self.metadata:
+                self.duplicates += 1
+                return None
+            if frame_id in self.frames:
+                arrived, payload = self._released(self.frames.pop(frame_id))
+            elif self.anonymous_frames:
+                arrived, payload = self._released(self.anonymous_frames.popleft())
+            else:
+                self.metadata[frame_id] = (now, metadata)
+                self._enforce_limit()
+                return None
+            self._complete(frame_id)
+            return payload, metadata, now - arrived
+
+    def add_frame(self, payload, frame_id=None, redelivered=False, now=None):
+        """Store a frame, returning (payload, metadata, waited) once paired"""
+        now = now or time.time()
+        with self.lock:
+            pair = self._add_frame(payload, frame_id, redelivered, now)
+        if pair is None and self.budget is not None and self.budget.exceeded():
+            # Reclaiming takes other buffers' locks, so never while holding ours
+            self.budget.reclaim()
+        return pair
+
+    def _add_frame(self, payload, frame_id, redelivered, now):
+        self._expire(now)
+        if frame_id is None:
+            checksum = (len(payload), zlib.crc32(payload))
+            if redelivered and checksum in self.recent_checksums:
+                self.duplicates += 1
+                return None
+            self.recent_checksums.append(checksum)
+            if not self.metadata:
+                self.anonymous_frames.append(self._stored(now, payload))
+                self._enforce_limit()
+                return None
+            frame_id, (arrived, metadata) = self.metadata.popitem(last=False)
+        else:
+            if frame_id in self.completed or frame_id in self.frames:
+                self.duplicates += 1
+                return None
+            if frame_id not in self.metadata:
+                self.frames[frame_id] = self._stored(now, payload)
+                self._enforce_limit()
+                return None
+            arrived, metadata = self.metadata.pop(frame_id)
+        self._complete(frame_id)
+        return payload, metadata, now - arrived
+
+    def add_complete(self, frame_id):
+        """Record a frame that arrived already paired; False if it is a duplicate"""
+        frame_id = str(frame_id)
+        with self.lock:
+            if frame_id in self.completed:
+                self.duplicates += 1
+                return False
+            self._complete(frame_id)
+            return True
+
+    def expire(self, now=None):
+        """Drop entries that waited longer than ttl for their counterpart"""
+        with self.lock:
+            self._expire(now or time.time())
+
+    def clear(self):
+        with self.lock:
+            self.metadata.clear()
+            self.frames.clear()
+            self.anonymous_frames.clear()
+            if self.budget is not None:
+                self.budget.release(self.pending_bytes)
+            self.pending_bytes = 0
+
+    def oldest_frame(self):
+        """Arrival time of the oldest unpaired frame, or None"""
+        heads = []
+        frames, anonymous_frames = self.frames, self.anonymous_frames
+        try:
+            if frames:
+                heads.append(next(iter(frames.values()))[0])
+            if anonymous_frames:
+                heads.append(anonymous_frames[0][0])
+        except (IndexError, RuntimeError, StopIteration):
+            # Changed under us; the budget will simply look again
+            pass
+        return min(heads) if heads else None
+
+    def evict_oldest_frame(self):
+        """Drop the oldest unpaired frame to free budget; False if none is left"""
+        with self.lock:
+            if self.frames and (
+                not self.anonymous_frames
+                or next(iter(self.frames.values()))[0] <= self.anonymous_frames[0][0]
+            ):
+                self._released(self.frames.popitem(last=False)[1])
+            elif self.anonymous_frames:
+                self._released(self.anonymous_frames.popleft())
+            else:
+                return False
+            self.budget_evicted += 1
+            return True
+
+    def _stored(self, now, payload):
+        self.pending_bytes += len(payload)
+        if self.budget is not None:
+            self.budget.charge(len(payload))
+        return now, payload
+
+    def _released(self, entry):
+        self.pending_bytes -= len(entry[1])
+        if self.budget is not None:
+            self.budget.release(len(entry[1]))
+        return entry
+
+    def _complete(self, frame_id):
+        self.completed[frame_id] = None
+        if len(self.completed) > self.dedup_window:
+            self.completed.popitem(last=False)
+
+    def _expire(self, now):
+        # Entries are stored in arrival order, so only the heads need checking
+        deadline = now - self.ttl
+        while self.metadata and next(iter(self.metadata.values()))[0] < deadline:
+            self.metadata.popitem(last=False)
+            self.orphaned += 1
+        while self.frames and next(iter(self.frames.values()))[0] < deadline:
+            self._released(self.frames.popitem(last=False)[1])
+            self.orphaned += 1
+        while self.anonymous_frames and self.anonymous_frames[0][0] < deadline:
+            self._released(self.anonymous_frames.popleft())
+            self.orphaned += 1
+
+    def _enforce_limit(self):
+        while len(self) > self.max_pending:
+            oldest = []
+            if self.metadata:
+                oldest.append((next(iter(self.metadata.values()))[0], 0))
+            if self.frames:
+                oldest.append((next(iter(self.frames.values()))[0], 1))
+            if self.anonymous_frames:
+                oldest.append((self.anonymous_frames[0][0], 2))
+            _, index = min(oldest)
+            if index == 0:
+                self.metadata.popitem(last=False)
+            elif index == 1:
+                self._released(self.frames.popitem(last=False)[1])
+            else:
+                self._released(self.anonymous_frames.popleft())
+            self.evicted += 1
@@ -0,0 +1,127 @@
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# What a full queue does with a new item:
+#   block       - wait for room (the producer stalls)
+#   drop_oldest - evict the oldest queued item to make room
+#   drop_newest - discard the incoming item
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+_CLOSED = object()
+
+
+class BoundedQueue:
+    """Thread-safe bounded FIFO with an explicit overflow policy"""
+
+    def __init__(self, maxsize=256, policy="block"):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = deque()
+        self.closed = False
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        """Queue an item, returning whatever had to be dropped (or None)"""
+        with self.lock:
+            if self.closed:
+                return item
+            dropped = None
+            if len(self.items) >= self.maxsize:
+                if self.policy == "drop_newest":
+                    return item
+                if self.policy == "drop_oldest":
+                    dropped = self.items.popleft()
+                else:
+                    while len(self.items) >= self.maxsize and not self.closed:
+                        self.not_full.wait()
+                    if self.closed:
+                        return item
+            self.items.append(item)
+            self.not_empty.notify()
+            return dropped
+
+    def get(self):
+        """Take the next item, or _CLOSED once the queue is closed and drained"""
+        with self.lock:
+            while not self.items and not self.closed:
+                self.not_empty.wait()
+            if not self.items:
+                return _CLOSED
+            item = self.items.popleft()
+            self.not_full.notify()
+            return item
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+
+class ShardedWorkerPool:
+    """Worker threads fed by per-worker bounded queues.
+
+    Items submitted with the same key always land on the same worker, so
+    they are handled in submission order while different keys run in
+    parallel.
+    """
+
+    def __init__(
+        self, name, handler, workers=2, maxsize=256, policy="block", on_drop=None
+    ):
+        self.name = name
+        self.handler = handler
+        self.on_drop = on_drop
+        self.queues = [BoundedQueue(maxsize, policy) for _ in range(max(1, workers))]
+        self.threads = []
+
+    def start(self):
+        """Start one thread per queue"""
+        if self.threads:
+            return
+        for index, queue in enumerate(self.queues):
+            thread = threading.Thread(
+                target=self._run, args=(queue,), name=f"{self.name}-{index}"
+            )
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, item):
+        """Queue an item on the worker that owns key"""
+        queue = self.queues[hash(key) % len(self.queues)]
+        dropped = queue.put(item)
+        if dropped is not None and self.on_drop:
+            self.on_drop(dropped)
+
+    def depth(self):
+        """Total number of items waiting across all workers"""
+        return sum(len(queue) for queue in self.queues)
+
+    def stop(self):
+        """Close the queues and wait for the workers to drain them"""
+        for queue in self.queues:
+            queue.close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _run(self, queue):
+        while True:
+            item = queue.get()
+            if item is _CLOSED:
+                return
+            try:
+                self.handler(item)
+            except Exception as e:
+                logger.warning("Error in %s worker: %s", self.name, e)
@@ -0,0 +1,219 @@
+"""Live preview of the sessions the extractor is receiving.
+
+The extractor hands every JPEG frame, as received, to a PreviewRelay,
+which keeps the last few of each session in a PreviewRing. The preview
+server streams a session to any number of viewers as MJPEG
+(multipart/x-mixed-replace), straight from the ring: every viewer is sent
+the same bytes object, with no re-encode and no filesystem read.
+
+    GET /preview                          open sessions, as JSON
+    GET /preview/{device_id}              the device's latest session
+    GET /preview/{device_id}/{timestamp}  one session
+
+Each viewer gets frames in order while it keeps up; one that falls more
+than a ring behind skips to the oldest frame still held, so a slow viewer
+costs a blocked thread of its own and never a growing buffer. The stream
+ends when the session completes.
+
+Requests are authenticated like the REST API, with a simplejwt access
+token: an "Authorization: Bearer" header, or a token query parameter for
+clients such as <img> tags that cannot set headers.
+"""
+
+import json
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Frames held per session
+PREVIEW_FRAMES = 4
+
+# Seconds a viewer waits for a frame before checking the session again
+VIEWER_TIMEOUT = 5.0
+
+BOUNDARY = b"frame"
+
+
+class PreviewRing:
+    """The last frames of one session, and the viewers waiting for more"""
+
+    def __init__(self, size=PREVIEW_FRAMES):
+        self.frames = deque(maxlen=size)
+        # Sequence number of the newest frame; 0 before the first
+        self.sequence = 0
+        self.closed = False
+        self.viewers = 0
+        self.changed = threading.Condition()
+
+    def publish(self, jpeg):
+        with self.changed:
+            self.sequence += 1
+            self.frames.append(jpeg)
+            self.changed.notify_all()
+
+    def close(self):
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    def next_frame(self, after, timeout=VIEWER_TIMEOUT):
+        """(sequence, jpeg) of the frame a viewer that sent `after` gets next.
+
+        Waits for one up to timeout seconds; None if none came or the ring
+        was closed.
+        """
+        with self.changed:
+            self.changed.wait_for(
+                lambda: self.closed or self.sequence > after, timeout
+            )
+            if self.closed or self.sequence <= after:
+                return None
+            oldest = self.sequence - len(self.frames) + 1
+            sequence = max(after + 1, oldest)
+            return sequence, self.frames[sequence - oldest]
+
+
+class PreviewRelay:
+    """PreviewRings of the open sessions, by (device_id, timestamp)"""
+
+    def __init__(self, size=PREVIEW_FRAMES):
+        self.size = size
+        self.rings = {}
+        self.lock = threading.Lock()
+
+    def publish(self, stream_key, jpeg):
+        ring = self.rings.get(stream_key)
+        if ring is None:
+            with self.lock:
+                ring = self.rings.setdefault(stream_key, PreviewRing(self.size))
+        ring.publish(jpeg)
+
+    def close(self, stream_key):
+        """End a completed session's streams and free its frames"""
+        with self.lock:
+            ring = self.rings.pop(stream_key, None)
+        if ring is not None:
+            ring.close()
+
+    def close_all(self):
+        with self.lock:
+            rings, self.rings = list(self.rings.values()), {}
+        for ring in rings:
+            ring.close()
+
+    def find(self, device_id, timestamp=None):
+        """A session's ring, or the device's latest session's if no timestamp"""
+        if timestamp is not None:
+            return self.rings.get((device_id, timestamp))
+        with self.lock:
+            sessions = [key for key in self.rings if key[0] == device_id]
+        return self.rings.get(max(sessions)) if sessions else None
+
+    def sessions(self):
+        with self.lock:
+            rings = list(self.rings.items())
+        return [
+            {
+                "device_id": device_id,
+                "timestamp": timestamp,
+                "frames": ring.sequence,
+                "viewers": ring.viewers,
+            }
+            for (device_id, timestamp), ring in rings
+        ]
+
+
+def authenticate(authorization, query):
+    """Whether a request carries a valid access token of an active user"""
+    from django.db import connection
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+
+    token = None
+    if authorization and authorization.startswith("Bearer "):
+        token = authorization[len("Bearer ") :]
+    elif query.get("token"):
+        token = query["token"][0]
+    if not token:
+        return False
+    authentication = JWTAuthentication()
+    try:
+        authentication.get_user(authentication.get_validated_token(token))
+        return True
+    except AuthenticationFailed:
+        return False
+    finally:
+        # Viewer threads come and go; do not leave their connections open
+        connection.close()
+
+
+def start_preview_server(relay, port, address="", authenticate=authenticate):
+    """Serve a PreviewRelay's sessions from a daemon thread"""
+
+    class PreviewHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            parts = url.path.strip("/").split("/")
+            if parts[0] != "preview" or len(parts) > 3:
+                self.send_error(404)
+                return
+            if not authenticate(
+                self.headers.get("Authorization"), parse_qs(url.query)
+            ):
+                self.send_error(401)
+                return
+            if len(parts) == 1:
+                self.send_sessions()
+                return
+            ring = relay.find(*parts[1:])
+            if ring is None:
+                self.send_error(404, "No open session for this device")
+                return
+            self.send_stream(ring)
+
+        def send_sessions(self):
+            body = json.dumps({"sessions": relay.sessions()}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_stream(self, ring):
+            self.send_response(200)
+            self.send_header(
+                "Content-Type",
+                f"multipart/x-mixed-replace; boundary={BOUNDARY.decode()}",
+            )
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            with ring.changed:
+                ring.viewers += 1
+                # Start from the newest frame
+                sequence = max(0, ring.sequence - 1)
+            try:
+                while not ring.closed:
+                    frame = ring.next_frame(sequence)
+                    if frame is None:
+                        continue
+                    sequence, jpeg = frame
+                    self.wfile.write(
+                        b"--%s\r\nContent-Type: image/jpeg\r\n"
+                        b"Content-Length: %d\r\n\r\n" % (BOUNDARY, len(jpeg))
+                    )
+                    self.wfile.write(jpeg)
+                    self.wfile.write(b"\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                with ring.changed:
+                    ring.viewers -= 1
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), PreviewHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
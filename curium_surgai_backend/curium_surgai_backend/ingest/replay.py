@@ -0,0 +1,248 @@
+"""Record live video stream traffic and replay it into the subscriber.
+
+A capture file starts with b"CSRC" + version and then holds one record
+per MQTT message (network byte order)::
+
+    offset        d    seconds since the first recorded message
+    topic_length  H
+    payload_length I
+    topic         utf-8
+    payload
+
+Record from a broker::
+
+    python -m ingest.replay record --broker localhost --output site.cap --duration 300
+
+Replay it without a broker, at real time, 4x, or as fast as possible, and
+optionally clone every device into several new device ids::
+
+    python -m ingest.replay replay site.cap --speed max --clones 16
+"""
+
+import argparse
+import os
+import shutil
+import ssl
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+CAPTURE_MAGIC = b"CSRC\x01"
+RECORD = struct.Struct("!dHI")
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(CAPTURE_MAGIC)
+        self.started = None
+        self.lock = threading.Lock()
+        self.records = 0
+
+    def write(self, topic, payload, arrival=None):
+        arrival = arrival or time.monotonic()
+        encoded_topic = topic.encode("utf-8")
+        with self.lock:
+            if self.started is None:
+                self.started = arrival
+            self.file.write(
+                RECORD.pack(arrival - self.started, len(encoded_topic), len(payload))
+            )
+            self.file.write(encoded_topic)
+            self.file.write(payload)
+            self.records += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_capture(path):
+    """Yield (offset, topic, payload) records from a capture file"""
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a stream capture")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            offset, topic_length, payload_length = RECORD.unpack(header)
+            topic = f.read(topic_length).decode("utf-8")
+            payload = f.read(payload_length)
+            if len(payload) < payload_length:
+                return
+            yield offset, topic, payload
+
+
+def clone_topic(topic, base_topic, clone):
+    """Rewrite the device id of a topic for the given clone number"""
+    if clone == 0:
+        return topic
+    device_id, _, rest = topic[len(base_topic) + 1 :].partition("/")
+    return f"{base_topic}/{device_id}-clone{clone}/{rest}"
+
+
+def record(
+    path,
+    broker_address="localhost",
+    broker_port=1883,
+    topic="video/stream",
+    duration=None,
+    username=None,
+    password=None,
+    ca_certs=None,
+    certfile=None,
+    keyfile=None,
+):
+    """Capture the live stream topics until duration elapses or Ctrl-C"""
+    from paho.mqtt import client as mqtt_client
+
+    writer = CaptureWriter(path)
+    client = mqtt_client.Client()
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(f"{topic}/#")
+        else:
+            print(f"Failed to connect, return code {rc}", file=sys.stderr)
+
+    def on_message(client, userdata, msg):
+        writer.write(msg.topic, msg.payload)
+
+    if username and password:
+        client.username_pw_set(username, password)
+    if ca_certs:
+        client.tls_set(
+            ca_certs=ca_certs,
+            certfile=certfile,
+            keyfile=keyfile,
+            cert_reqs=ssl.CERT_REQUIRED,
+            tls_version=ssl.PROTOCOL_TLSv1_2,
+        )
+        client.tls_insecure_set(True)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(broker_address, broker_port)
+    client.loop_start()
+    try:
+        if duration:
+            time.sleep(duration)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        writer.close()
+    return writer.records
+
+
+def replay(path, subscriber, speed=1.0, clones=1):
+    """Feed a capture into a subscriber's MQTT entry point.
+
+    speed scales the recorded inter-arrival times (2.0 replays twice as
+    fast); 0 replays as fast as the subscriber accepts messages.
+    """
+    started = time.monotonic()
+    messages = 0
+    for offset, topic, payload in read_capture(path):
+        if speed:
+            delay = started + offset / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        for clone in range(clones):
+            subscriber.route_message(
+                clone_topic(topic, subscriber.topic, clone), payload
+            )
+            messages += 1
+    return messages, time.monotonic() - started
+
+
+def run_replay(path, speed=1.0, clones=1, output_folder=None, **options):
+    """Replay a capture into a fresh subscriber that writes to output_folder"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from extractor import MultiDeviceVideoSubscriber
+    from ingest.local_broker import LocalBroker
+
+    keep_output = output_folder is not None
+    output_folder = output_folder or tempfile.mkdtemp(prefix="ingest-replay-")
+    subscriber = MultiDeviceVideoSubscriber(
+        base_output_folder=output_folder, client=LocalBroker().client(), **options
+    )
+    subscriber.start_pipeline()
+    subscriber.monitor_thread.start()
+    try:
+        messages, elapsed = replay(path, subscriber, speed, clones)
+    finally:
+        subscriber.stop()
+        # Trackers are freed as sessions complete: count what was written
+        devices = sum(
+            entry.is_dir() and not entry.name.startswith(".")
+            for entry in os.scandir(output_folder)
+        )
+        if not keep_output:
+            shutil.rmtree(output_folder, ignore_errors=True)
+    return {
+        "messages": messages,
+        "frames": subscriber.metrics.counters["frames"],
+        "devices": devices,
+        "elapsed_s": elapsed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record or replay stream traffic")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record")
+    record_parser.add_argument("--output", required=True)
+    record_parser.add_argument("--broker", default="localhost")
+    record_parser.add_argument("--port", type=int, default=1883)
+    record_parser.add_argument("--topic", default="video/stream")
+    record_parser.add_argument("--duration", type=float)
+    record_parser.add_argument("--username")
+    record_parser.add_argument("--password")
+    record_parser.add_argument("--ca-certs")
+    record_parser.add_argument("--certfile")
+    record_parser.add_argument("--keyfile")
+
+    replay_parser = commands.add_parser("replay")
+    replay_parser.add_argument("capture")
+    replay_parser.add_argument(
+        "--speed", default="1", help="speed multiplier, or 'max' for no pacing"
+    )
+    replay_parser.add_argument("--clones", type=int, default=1)
+    replay_parser.add_argument("--output-folder")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        count = record(
+            args.output,
+            args.broker,
+            args.port,
+            args.topic,
+            args.duration,
+            args.username,
+            args.password,
+            args.ca_certs,
+            args.certfile,
+            args.keyfile,
+        )
+        print(f"Recorded {count} messages to {args.output}")
+    else:
+        speed = 0 if args.speed == "max" else float(args.speed)
+        result = run_replay(args.capture, speed, args.clones, args.output_folder)
+        print(
+            f"Replayed {result['messages']} messages ({result['frames']} frames, "
+            f"{result['devices']} devices) in {result['elapsed_s']:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
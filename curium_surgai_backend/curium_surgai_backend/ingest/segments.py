@@ -0,0 +1,182 @@
+"""Append-only segment container for a session's frames.
+
+A session folder holds rolling segments, each made of three files:
+
+    segment_NNNNN.dat   image bytes, appended back to back
+    segment_NNNNN.meta  metadata records (compact JSON), back to back
+    segment_NNNNN.idx   fixed-size index records, one per frame:
+                        frame_number I, offset Q, length I, timestamp d,
+                        metadata offset Q, metadata length I
+
+The index is written last, so an index record always points at data
+that is already on disk; a torn tail left by a crash is ignored by the
+reader. Run ``python -m ingest.segments export <folder> [<dest>]`` to
+convert a session back to one JPEG and one JSON file per frame.
+"""
+
+import json
+import os
+import re
+import struct
+import sys
+import threading
+from datetime import datetime
+
+INDEX_RECORD = struct.Struct("<IQIdQI")
+SEGMENT_PATTERN = re.compile(r"^segment_(\d+)\.idx$")
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+
+
+def segment_path(folder, number, extension):
+    return os.path.join(folder, f"segment_{number:05d}.{extension}")
+
+
+def has_segments(folder):
+    return any(SEGMENT_PATTERN.match(name) for name in os.listdir(folder))
+
+
+class SegmentWriter:
+    """Append frames of one session to rolling segment files"""
+
+    def __init__(self, folder, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.folder = folder
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.files = None
+        numbers = [
+            int(match.group(1))
+            for match in map(SEGMENT_PATTERN.match, os.listdir(folder))
+            if match
+        ]
+        # Never append to a segment left behind by an earlier writer
+        self.segment_number = max(numbers) + 1 if numbers else 0
+
+    def append(self, frame_number, timestamp, data, metadata):
+        """Store one frame; timestamp is POSIX seconds"""
+        record = json.dumps(metadata, separators=(",", ":")).encode("utf-8")
+        with self.lock:
+            if self.files is None or self.files[0].tell() >= self.segment_size:
+                self._roll()
+            data_file, meta_file, index_file = self.files
+            offset = data_file.tell()
+            data_file.write(data)
+            meta_offset = meta_file.tell()
+            meta_file.write(record)
+            data_file.flush()
+            meta_file.flush()
+            index_file.write(
+                INDEX_RECORD.pack(
+                    frame_number,
+                    offset,
+                    len(data),
+                    timestamp,
+                    meta_offset,
+                    len(record),
+                )
+            )
+            index_file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.files:
+                for f in self.files:
+                    f.close()
+                self.files = None
+
+    def _roll(self):
+        if self.files:
+            for f in self.files:
+                f.close()
+            self.segment_number += 1
+        self.files = tuple(
+            open(segment_path(self.folder, self.segment_number, extension), "ab")
+            for extension in ("dat", "meta", "idx")
+        )
+
+
+class SegmentReader:
+    """Random access to the frames stored in a session's segments"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        # frame_number -> (segment, offset, length, timestamp, meta offset, meta length)
+        self.index = {}
+        self.handles = {}
+        for name in sorted(os.listdir(folder)):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                self._load_index(int(match.group(1)))
+
+    def _load_index(self, number):
+        data_size = os.path.getsize(segment_path(self.folder, number, "dat"))
+        meta_size = os.path.getsize(segment_path(self.folder, number, "meta"))
+        with open(segment_path(self.folder, number, "idx"), "rb") as f:
+            raw = f.read()
+        usable = len(raw) - len(raw) % INDEX_RECORD.size
+        for record in INDEX_RECORD.iter_unpack(raw[:usable]):
+            frame_number, offset, length, timestamp, meta_offset, meta_length = record
+            if offset + length > data_size or meta_offset + meta_length > meta_size:
+                break
+            self.index[frame_number] = (number,) + record[1:]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        """Yield (frame_number, data, metadata) in frame_number order"""
+        for frame_number in self.frame_numbers():
+            metadata = self.read_metadata(frame_number)
+            yield frame_number, self.read_frame(frame_number), metadata
+
+    def frame_numbers(self):
+        return sorted(self.index)
+
+    def timestamp(self, frame_number):
+        return self.index[frame_number][3]
+
+    def read_frame(self, frame_number):
+        number, offset, length, _, _, _ = self.index[frame_number]
+        return self._read(number, "dat", offset, length)
+
+    def read_metadata(self, frame_number):
+        number, _, _, _, meta_offset, meta_length = self.index[frame_number]
+        return json.loads(self._read(number, "meta", meta_offset, meta_length))
+
+    def close(self):
+        for f in self.handles.values():
+            f.close()
+        self.handles = {}
+
+    def _read(self, number, extension, offset, length):
+        key = (number, extension)
+        if key not in self.handles:
+            self.handles[key] = open(segment_path(self.folder, number, extension), "rb")
+        return os.pread(self.handles[key].fileno(), length, offset)
+
+
+def export_files(folder, dest=None):
+    """Write a segmented session out as one JPEG and one JSON file per frame"""
+    dest = dest or folder
+    os.makedirs(dest, exist_ok=True)
+    reader = SegmentReader(folder)
+    try:
+        for frame_number, data, metadata in reader:
+            frame_timestamp = datetime.fromisoformat(metadata["timestamp"])
+            filename = (
+                f"{frame_timestamp.strftime('%Y%m%d_%H%M%S')}_frame{frame_number}.jpg"
+            )
+            with open(os.path.join(dest, filename), "wb") as f:
+                f.write(data)
+            metadata_filename = f"{os.path.splitext(filename)[0]}_metadata.json"
+            with open(os.path.join(dest, metadata_filename), "w") as f:
+                json.dump(metadata, f, indent=4)
+        return len(reader)
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4) or sys.argv[1] != "export":
+        sys.exit("usage: python -m ingest.segments export <folder> [<dest>]")
+    count = export_files(sys.argv[2], sys.argv[3] if len(sys.argv) == 4 else None)
+    print(f"Exported {count} frames")
@@ -0,0 +1,86 @@
+"""Stream status snapshots shared between the extractor and the API.
+
+The extractor's monitor thread writes a JSON snapshot of its sessions to
+the output folder every few seconds (write to a temporary file, then
+os.replace), so readers always see a complete file and never take any of
+the extractor's locks. Each worker of a shared subscription writes its
+own file; read_status merges them.
+
+A snapshot also lists the worker's recent video builds (queued, running,
+and the last few finished), with the chunks done of parallel builds.
+"""
+
+import glob
+import json
+import os
+import time
+
+STATUS_FILENAME = "stream_status.json"
+STATUS_PATTERN = "stream_status*.json"
+
+
+def status_filename(worker_index=0, worker_count=1):
+    if worker_count > 1:
+        return f"stream_status-{worker_index}.json"
+    return STATUS_FILENAME
+
+
+def write_status(folder, snapshot, filename=STATUS_FILENAME):
+    """Atomically replace a status snapshot"""
+    path = os.path.join(folder, filename)
+    partial_path = f"{path}.{os.getpid()}.tmp"
+    with open(partial_path, "w") as f:
+        json.dump(snapshot, f, default=str)
+    os.replace(partial_path, path)
+
+
+# path -> (mtime, snapshot), so frequent polling does not re-parse files
+_cache = {}
+
+
+def _load(path):
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    cached = _cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    _cache[path] = (mtime, snapshot)
+    return snapshot
+
+
+def read_status(folder, now=None):
+    """Merge the snapshots of every worker writing to folder.
+
+    Snapshots older than three publish intervals are flagged stale, since
+    their extractor has stopped updating them.
+    """
+    now = now or time.time()
+    sessions = []
+    workers = []
+    builds = []
+    for path in sorted(glob.glob(os.path.join(folder, STATUS_PATTERN))):
+        snapshot = _load(path)
+        if not snapshot:
+            continue
+        age = now - snapshot["generated_at"]
+        stale = age > 3 * snapshot["interval"]
+        workers.append(
+            {
+                "worker": snapshot.get("worker"),
+                "generated_at": snapshot["generated_at"],
+                "age": age,
+                "stale": stale,
+            }
+        )
+        for session in snapshot["sessions"]:
+            sessions.append(dict(session, stale=stale))
+        for build in snapshot.get("builds", ()):
+            builds.append(dict(build, worker=snapshot.get("worker")))
+    return {"workers": workers, "sessions": sessions, "builds": builds}
@@ -0,0 +1,93 @@
+"""Frame stores, used by the write workers.
+
+Stores only write: a job's image arrives encoded in job["data"], either as
+received or as the transform workers re-encoded it.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from ingest.segments import DEFAULT_SEGMENT_SIZE, SegmentWriter
+
+STORAGE_BACKENDS = ("files", "segments")
+
+
+class FileFrameStore:
+    """One JPEG plus one JSON metadata file per frame"""
+
+    def write(self, folder, job, metrics=None):
+        filepath = os.path.join(folder, job["filename"])
+
+        # Save the frame
+        started = time.perf_counter()
+        with open(filepath, "wb") as f:
+            f.write(job["data"])
+        written = time.perf_counter()
+
+        # Save metadata
+        metadata_filename = f"{os.path.splitext(job['filename'])[0]}_metadata.json"
+        metadata_filepath = os.path.join(folder, metadata_filename)
+        with open(metadata_filepath, "w") as f:
+            json.dump(job["metadata"], f, indent=4)
+
+        if metrics:
+            metrics.observe("write_image", written - started)
+            metrics.since("write_metadata", written)
+
+    def close_session(self, folder):
+        pass
+
+    def close(self):
+        pass
+
+
+class SegmentFrameStore:
+    """Frames appended to rolling segment files (see ingest.segments)"""
+
+    def __init__(self, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.segment_size = segment_size
+        self.writers = {}
+        self.lock = threading.Lock()
+
+    def write(self, folder, job, metrics=None):
+        # Image and metadata go out in one append, timed as write_image
+        started = time.perf_counter()
+        writer = self.writers.get(folder)
+        if writer is None:
+            with self.lock:
+                writer = self.writers.get(folder)
+                if writer is None:
+                    writer = SegmentWriter(folder, self.segment_size)
+                    self.writers[folder] = writer
+        frame_timestamp = datetime.fromisoformat(job["metadata"]["timestamp"])
+        writer.append(
+            job["frame_number"],
+            frame_timestamp.timestamp(),
+            job["data"],
+            job["metadata"],
+        )
+        if metrics:
+            metrics.since("write_image", started)
+
+    def close_session(self, folder):
+        with self.lock:
+            writer = self.writers.pop(folder, None)
+        if writer:
+            writer.close()
+
+    def close(self):
+        with self.lock:
+            writers, self.writers = list(self.writers.values()), {}
+        for writer in writers:
+            writer.close()
+
+
+def create_store(backend, segment_size=DEFAULT_SEGMENT_SIZE):
+    if backend == "segments":
+        return SegmentFrameStore(segment_size)
+    if backend == "files":
+        return FileFrameStore()
+    raise ValueError(f"Unknown storage backend: {backend}")
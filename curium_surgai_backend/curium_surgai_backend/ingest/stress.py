@@ -0,0 +1,259 @@
+"""Concurrency stress checks for MultiDeviceVideoSubscriber.
+
+Hammers the tracker registry, the per-session counters, the stream
+deadlines and the full decode/write pipeline from many threads at once,
+and fails if any update is lost or a session ends up with two trackers.
+
+    python -m ingest.stress --threads 16 --devices 64 --frames 200
+
+Exits non-zero when a check fails.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+
+def run_threads(count, target):
+    """Run target(index) on count threads released together"""
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def run(index):
+        barrier.wait()
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - started
+
+
+def check_tracker_creation(subscriber, threads, rounds):
+    """Threads racing to create the same sessions must share one tracker each"""
+    failures = []
+    for round_number in range(rounds):
+        seen = defaultdict(set)
+
+        def create(index):
+            for device in range(8):
+                tracker = subscriber.get_device_tracker(
+                    f"race-{device}", f"round-{round_number}"
+                )
+                seen[tracker.stream_key].add(id(tracker))
+
+        run_threads(threads, create)
+        for stream_key, trackers in seen.items():
+            registered = subscriber.device_trackers[stream_key]
+            if len(trackers) != 1 or id(registered) not in trackers:
+                failures.append(f"{stream_key}: {len(trackers)} trackers")
+            subscriber.release_tracker(stream_key)
+    return failures
+
+
+def check_counters(subscriber, threads, updates):
+    """Concurrent counter updates on one session must all be kept"""
+    tracker = subscriber.get_device_tracker("counters", "session")
+    frames_before = subscriber.metrics.counters["frames"]
+
+    def update(index):
+        for _ in range(updates):
+            tracker.enqueued()
+            tracker.update_stats(10)
+            tracker.metrics.count("frames")
+            tracker.metrics.observe("decode", 0.001)
+            tracker.dequeued(dropped="frame")
+
+    elapsed = run_threads(threads, update)
+    expected = threads * updates
+    failures = []
+    checks = {
+        "queue_depth": (tracker.queue_depth, 0),
+        "frames_dropped": (tracker.frames_dropped, expected),
+        "frames_received": (tracker.frames_received, expected),
+        "frames counter": (tracker.metrics.counters["frames"], expected),
+        "process frames counter": (
+            subscriber.metrics.counters["frames"] - frames_before,
+            expected,
+        ),
+        "decode observations": (tracker.metrics.stages["decode"].count, expected),
+    }
+    for name, (actual, wanted) in checks.items():
+        if actual != wanted:
+            failures.append(f"{name}: {actual} != {wanted}")
+    subscriber.release_tracker(tracker.stream_key)
+    return failures, expected * 5 / elapsed
+
+
+def check_deadlines(threads, touches):
+    """Touches racing expiry must never leave a key that cannot expire"""
+    from ingest.deadlines import DeadlineTracker
+
+    deadlines = DeadlineTracker(0.0005)
+    expired = set()
+    done = threading.Event()
+
+    def expire():
+        while not done.is_set():
+            expired.update(deadlines.expired())
+
+    monitor = threading.Thread(target=expire)
+    monitor.start()
+    touched = set()
+
+    def touch(index):
+        for count in range(touches):
+            key = (index, count % 16)
+            deadlines.touch(key)
+            touched.add(key)
+
+    run_threads(threads, touch)
+    done.set()
+    monitor.join()
+    expired.update(deadlines.expired(time.time() + 1))
+    failures = []
+    if len(deadlines) or deadlines.heap:
+        failures.append(f"{len(deadlines)} keys left, {len(deadlines.heap)} deadlines")
+    if expired != touched:
+        failures.append(f"{len(touched - expired)} touched keys never expired")
+    return failures
+
+
+def check_pipeline(subscriber, output_folder, threads, devices, frames):
+    """Every frame published from many threads must be written exactly once"""
+    from ingest.envelope import encode_envelope
+
+    payload = b"\xff\xd8stress\xff\xd9"
+    start_time = datetime(2024, 1, 1)
+
+    def publish(index):
+        # Each thread publishes every threads-th frame of every device, so
+        # all devices are fed by all threads at once
+        for frame_number in range(index, frames, threads):
+            for device in range(devices):
+                metadata = {
+                    "frame_id": frame_number,
+                    "frame_number": frame_number,
+                    "timestamp": (
+                        start_time + timedelta(seconds=frame_number)
+                    ).isoformat(),
+                    "encoding": "jpg",
+                }
+                topic = f"{subscriber.topic}/stress-{device}/session"
+                if frame_number % 2:
+                    subscriber.route_message(
+                        f"{topic}/envelope", encode_envelope(metadata, payload)
+                    )
+                else:
+                    subscriber.route_message(
+                        f"{topic}/frame/{frame_number}", payload
+                    )
+                    subscriber.route_message(
+                        f"{topic}/metadata", json.dumps(metadata).encode()
+                    )
+
+    elapsed = run_threads(threads, publish)
+    subscriber.drain_pipeline()
+
+    failures = []
+    sessions = [
+        tracker
+        for tracker in subscriber.device_trackers.values()
+        if tracker.device_id.startswith("stress-")
+    ]
+    if len(sessions) != devices:
+        failures.append(f"{len(sessions)} stress sessions, expected {devices}")
+    for tracker in sessions:
+        folder = os.path.join(output_folder, tracker.device_id, tracker.timestamp)
+        written = [name for name in os.listdir(folder) if name.endswith(".jpg")]
+        if tracker.frames_received != frames or len(written) != frames:
+            failures.append(
+                f"{tracker.device_id}: {tracker.frames_received} received, "
+                f"{len(written)} written, expected {frames}"
+            )
+        if tracker.queue_depth or len(tracker.pairing):
+            failures.append(
+                f"{tracker.device_id}: queue depth {tracker.queue_depth}, "
+                f"{len(tracker.pairing)} unpaired"
+            )
+    return failures, devices * frames / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--devices", type=int, default=32)
+    parser.add_argument("--frames", type=int, default=100, help="frames per device")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--decode-workers", type=int, default=4)
+    parser.add_argument("--write-workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from extractor import MultiDeviceVideoSubscriber
+    from ingest.local_broker import LocalBroker
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # Switch tracker lookups often so the checks race as much as possible
+    sys.setswitchinterval(1e-6)
+
+    output_folder = tempfile.mkdtemp(prefix="ingest-stress-")
+    subscriber = MultiDeviceVideoSubscriber(
+        base_output_folder=output_folder,
+        client=LocalBroker().client(),
+        decode_workers=args.decode_workers,
+        write_workers=args.write_workers,
+        live_encoding=False,
+        stream_timeout=3600,
+        status_interval=0,
+    )
+    subscriber.start_pipeline()
+    results = {}
+    try:
+        results["tracker creation"] = check_tracker_creation(
+            subscriber, args.threads, args.rounds
+        )
+        results["counters"], rate = check_counters(
+            subscriber, args.threads, args.updates
+        )
+        print(f"counter updates: {rate:,.0f}/s on {args.threads} threads")
+        results["deadlines"] = check_deadlines(args.threads, args.updates)
+        results["pipeline"], rate = check_pipeline(
+            subscriber, output_folder, args.threads, args.devices, args.frames
+        )
+        print(f"pipeline: {rate:,.0f} frames/s on {args.threads} publishing threads")
+    finally:
+        subscriber.store.close()
+        subscriber.assembler.shutdown()
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+    failed = False
+    for name, failures in results.items():
+        print(f"{name}: {'FAIL' if failures else 'ok'}")
+        for failure in failures[:10]:
+            print(f"    {failure}")
+        failed = failed or bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
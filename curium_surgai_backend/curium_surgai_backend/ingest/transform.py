@@ -0,0 +1,177 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+from ingest.pipeline import _CLOSED, BoundedQueue
+
+logger = logging.getLogger(__name__)
+
+
+class FrameBufferPool:
+    """Reusable uint8 pixel buffers, kept per shape.
+
+    acquire() hands out a free buffer of the requested shape (allocating
+    one only when none is free) and release() returns it once the last
+    consumer is done with the pixels.
+    """
+
+    def __init__(self, max_free=16):
+        self.max_free = max_free
+        self.free = {}
+        self.lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self, shape):
+        shape = tuple(shape)
+        with self.lock:
+            buffers = self.free.get(shape)
+            if buffers:
+                return buffers.pop()
+            self.allocated += 1
+        return np.empty(shape, dtype=np.uint8)
+
+    def release(self, buffer):
+        with self.lock:
+            buffers = self.free.setdefault(buffer.shape, [])
+            if len(buffers) < self.max_free:
+                buffers.append(buffer)
+
+
+class StreamSequencer:
+    """Hand results on in submission order, whatever order they finish in"""
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.lock = threading.Lock()
+        self.next_sequence = 0
+        self.next_emit = 0
+        # sequence -> finished result (None for skipped items)
+        self.ready = {}
+
+    def reserve(self):
+        with self.lock:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            return sequence
+
+    def complete(self, sequence, result):
+        """Record a finished item and emit every result that is now in order.
+
+        Emitting under the lock keeps two finishing workers from handing
+        results on out of order.
+        """
+        with self.lock:
+            self.ready[sequence] = result
+            while self.next_emit in self.ready:
+                result = self.ready.pop(self.next_emit)
+                self.next_emit += 1
+                if result is None:
+                    continue
+                try:
+                    self.emit(result)
+                except Exception as e:
+                    logger.warning("Error passing on sequenced result: %s", e)
+
+    def idle(self):
+        return self.next_emit == self.next_sequence
+
+
+class TransformPool:
+    """Pixel work for all streams on a shared set of worker threads.
+
+    Frames of every stream, including consecutive frames of one stream,
+    are transformed in parallel; a per-stream StreamSequencer then passes
+    the results to on_result in the order they were submitted. The
+    workers are threads, since OpenCV releases the GIL while it decodes
+    and resizes.
+    """
+
+    def __init__(
+        self,
+        name,
+        transform,
+        on_result,
+        workers=None,
+        maxsize=256,
+        policy="block",
+        on_drop=None,
+    ):
+        self.name = name
+        self.transform = transform
+        self.on_result = on_result
+        self.on_drop = on_drop
+        self.workers = workers or os.cpu_count() or 1
+        self.queue = BoundedQueue(maxsize, policy)
+        self.sequencers = {}
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        if self.threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{index}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, stream_key, item):
+        """Queue an item for the transform workers"""
+        sequencer = self._sequencer(stream_key)
+        dropped = self.queue.put((sequencer, sequencer.reserve(), item))
+        if dropped is not None:
+            self._drop(dropped)
+
+    def submit_ready(self, stream_key, item):
+        """Pass on an item that needs no transform, in order with the rest"""
+        sequencer = self._sequencer(stream_key)
+        sequencer.complete(sequencer.reserve(), item)
+
+    def forget(self, stream_key):
+        """Drop the sequencer of a finished stream once nothing is in flight"""
+        with self.lock:
+            sequencer = self.sequencers.get(stream_key)
+            if sequencer is not None and sequencer.idle():
+                del self.sequencers[stream_key]
+
+    def depth(self):
+        return len(self.queue)
+
+    def stop(self):
+        """Close the queue and wait for the workers to drain it"""
+        self.queue.close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _sequencer(self, stream_key):
+        sequencer = self.sequencers.get(stream_key)
+        if sequencer is None:
+            with self.lock:
+                sequencer = self.sequencers.get(stream_key)
+                if sequencer is None:
+                    sequencer = StreamSequencer(self.on_result)
+                    self.sequencers[stream_key] = sequencer
+        return sequencer
+
+    def _drop(self, entry):
+        sequencer, sequence, item = entry
+        if self.on_drop:
+            self.on_drop(item)
+        # Let the frames behind the dropped one through
+        sequencer.complete(sequence, None)
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is _CLOSED:
+                return
+            sequencer, sequence, item = entry
+            result = None
+            try:
+                result = self.transform(item)
+            except Exception as e:
+                logger.warning("Error in %s worker: %s", self.name, e)
+            sequencer.complete(sequence, result)
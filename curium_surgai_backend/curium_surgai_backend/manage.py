@@ -3,46 +3,13 @@
 import os
 import sys
 
-import threading
-from extractor import MultiDeviceVideoSubscriber  # Import the extractor
-from django.conf import settings
-import logging
-
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
 
-logger = logging.getLogger()
-
-logger.setLevel(logging.DEBUG)
-
-
-def start_extractor():
-    """Start the MultiDeviceVideoSubscriber in a background thread"""
-    subscriber = MultiDeviceVideoSubscriber(
-        broker_address="azurecpu1.curium.life",
-        broker_port=1883,
-        topic="video/stream",
-        base_output_folder=os.path.join(settings.MEDIA_ROOT, "received_frames"),
-        username="admin",
-        password="letmein",
-    )
-
-    try:
-        subscriber.start()
-    except KeyboardInterrupt:
-        subscriber.stop()
-    except Exception as e:
-        logger.exception(e)
-
 
 def main():
     """Run administrative tasks."""
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
 
-    # Start extractor in a background thread
-    extractor_thread = threading.Thread(target=start_extractor)
-    extractor_thread.daemon = True
-    extractor_thread.start()
-
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
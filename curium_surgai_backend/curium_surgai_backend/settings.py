@@ -55,6 +55,18 @@ LOGGING = {
             "level": os.getenv("DJANGO_LOG_LEVEL", "INFO"),
             "propagate": False,
         },
+        # The extractor logs errors rate-limited and a summary once a minute
+        # at INFO; DEBUG adds per-session detail
+        "extractor": {
+            "handlers": ["console"],
+            "level": os.getenv("EXTRACTOR_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+        "ingest": {
+            "handlers": ["console"],
+            "level": os.getenv("EXTRACTOR_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
     },
 }
 
@@ -146,6 +158,43 @@ AUTH_USER_MODEL = "user.User"
 
 MEDIA_ROOT = "data/"
 
+# Where the extractor publishes the snapshot behind the stream status API
+STREAM_STATUS_FOLDER = os.path.join(MEDIA_ROOT, "received_frames")
+
+# The frame extractor worker, run with `python manage.py run_extractor`. Keys
+# are MultiDeviceVideoSubscriber options, plus the ingest "engine" ("threads"
+# or "asyncio", see extractor.ENGINES).
+EXTRACTOR = {
+    "engine": os.getenv("EXTRACTOR_ENGINE", default="threads"),
+    "broker_address": os.getenv("MQTT_BROKER_ADDRESS", default="azurecpu1.curium.life"),
+    "broker_port": int(os.getenv("MQTT_BROKER_PORT", default="1883")),
+    "topic": os.getenv("MQTT_TOPIC", default="video/stream"),
+    "username": os.getenv("MQTT_USERNAME", default="admin"),
+    "password": os.getenv("MQTT_PASSWORD", default="letmein"),
+    "base_output_folder": STREAM_STATUS_FOLDER,
+    "decode_workers": int(os.getenv("EXTRACTOR_DECODE_WORKERS", default="2")),
+    "write_workers": int(os.getenv("EXTRACTOR_WRITE_WORKERS", default="2")),
+    # Video build processes; long sessions are built in chunks spread over
+    # all of them. Raise it on hosts with cores to spare for builds
+    "assembly_workers": int(os.getenv("EXTRACTOR_ASSEMBLY_WORKERS", default="2")),
+    # 0 means one transform worker per core
+    "transform_workers": int(os.getenv("EXTRACTOR_TRANSFORM_WORKERS", default="0"))
+    or None,
+    "metrics_port": int(os.getenv("EXTRACTOR_METRICS_PORT", default="0")) or None,
+    # Live MJPEG preview of the sessions being received (0 disables it)
+    "preview_port": int(os.getenv("EXTRACTOR_PREVIEW_PORT", default="0")) or None,
+    # Seconds per segment of the live HLS playlist in each session folder
+    # (0 disables it); needs ffmpeg
+    "hls_time": float(os.getenv("EXTRACTOR_HLS_TIME", default="2")) or None,
+    "share_group": os.getenv("EXTRACTOR_SHARE_GROUP") or None,
+    "worker_index": int(os.getenv("EXTRACTOR_WORKER_INDEX", default="0")),
+    "worker_count": int(os.getenv("EXTRACTOR_WORKER_COUNT", default="1")),
+}
+
+# Seconds between reloads of the extractor's registry of active devices,
+# whose messages are the only ones it accepts; 0 accepts any device
+EXTRACTOR_DEVICE_REFRESH = float(os.getenv("EXTRACTOR_DEVICE_REFRESH", default="60"))
+
 # Email settings
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 EMAIL_HOST = "smtp.gmail.com"